@@ -2,7 +2,7 @@ __version__ = "1.1.0"
 
 
 import biobabel.io
-from biobabel.io import load
+from biobabel.io import load, load_many, register_dialect
 
 # from biobabel import * # lint doesn't like this - perhaps we can work without it.
 
@@ -10,6 +10,16 @@ from biobabel.biodata import Biodata
 
 DATEFORMAT = "%Y/%m/%d %H:%M:%S %Z%z"
 
+
+def __getattr__(name):
+    # The loader modules (biobabel.load_acq etc.) are imported only when they are used,
+    # since they pull in heavy dependencies (pandas, pyxdf, ...).
+    if name.startswith("load_") or name in ["viewer", "save_hdphysio5"]:
+        import importlib
+
+        return importlib.import_module("biobabel." + name)
+    raise AttributeError("module 'biobabel' has no attribute '{}'".format(name))
+
 import sys
 
 import argparse
@@ -20,10 +30,10 @@ def info():
     Display quick information about a given file.
     """
 
-    get_file("Display basic information about a physiology file.")
+    get_file("Display basic information about a physiology file.", lazy=True)
 
 
-def get_file(descr=""):
+def get_file(descr="", lazy=False, follow=False):
     """
     Figure out which file wants to be opened.
     First check the command line if a file was indicated.
@@ -32,9 +42,36 @@ def get_file(descr=""):
     Open the file, and then print a summary.
 
     descr : A description of the purpose of the script for which this is done.
+    lazy : if True, channel data is only read from the file when accessed (where the format allows)
+    follow : if True, offer the option to keep reading a file that is still being written
     """
-    import os
+    parser = file_parser(descr)
+    if follow:
+        parser.add_argument(
+            "-f",
+            "--follow",
+            action="store_true",
+            help="Keep reading data as it is appended to the file while recording (TeensyECG only).",
+        )
+    args = parser.parse_args()
+
+    if follow and args.follow:
+        import biobabel.load_teensyecg
+
+        fname = check_file(args.filename)
+        bio = biobabel.load_teensyecg.TeensyECGStream(fname).bio
+        bio.print()
+        bio.meta["filename"] = fname
+        return bio
+
+    return open_file(args.filename, lazy=lazy)
 
+
+def file_parser(descr=""):
+    """
+    Create a command line parser for scripts that work on a single file,
+    to which the script can add its own options.
+    """
     parser = argparse.ArgumentParser(description=descr)
     parser.add_argument(
         "filename",
@@ -47,11 +84,17 @@ def get_file(descr=""):
         action="version",
         version="%(prog)s {version}".format(version=__version__),
     )
-    args = parser.parse_args()
+    return parser
 
-    if args.filename:
-        fname = args.filename
-    else:
+
+def check_file(fname):
+    """
+    Make sure we have an existing file to work on, asking the user to select one if none was given.
+    Exits if there is none.
+    """
+    import os
+
+    if not fname:
         fname = ask_bio_file()
 
     if not fname:
@@ -62,7 +105,15 @@ def get_file(descr=""):
         print("File {} does not seem to exist. Exiting now.".format(fname))
         sys.exit(-1)
 
-    bio = biobabel.io.load(fname)
+    return fname
+
+
+def open_file(fname, lazy=False):
+    """
+    Open a file given on the command line (or ask for one if fname is None) and print a summary.
+    """
+    fname = check_file(fname)
+    bio = biobabel.io.load(fname, lazy=lazy)
     bio.print()
     bio.meta["filename"] = fname
     return bio
@@ -90,7 +141,11 @@ def display(advanced=False):
     advanced : if True, show the advanced viewer (TK GUI) otherwise show a simple matplotlib
     """
 
-    bio = get_file("Produce a quick plot of the contents of a physiology file.")
+    bio = get_file(
+        "Produce a quick plot of the contents of a physiology file.",
+        lazy=True,
+        follow=advanced,
+    )
 
     if advanced:
         import biobabel.viewer as viewer
@@ -143,15 +198,14 @@ def split():
     That is, given a file with several channels and markers, produce a set of files that each contain
     the portion of signal between subsequent markers.
     """
-    bio = get_file(
-        "Split file into smaller files along time markers."
-    )  # attempt to get a file name to work on
+    # Read lazily where the format allows, so that the data is read block by block while writing
+    bio = get_file("Split file into smaller files along time markers.", lazy=True)
     # If we're still here that means we have loaded a file
 
     # Extract all the markers, throw them on a big heap
     ts = []
     for m in bio.get_markers():
-        ts += bio.get_marker(m)
+        ts += list(bio.get_marker(m))
 
     if 0 not in ts:
         ts.append(0)
@@ -171,6 +225,7 @@ def split():
 
     fbase, ext = os.path.splitext(fname)
 
+    segments = []
     tprev = ts[0]
     for i, t in enumerate(ts):
 
@@ -178,15 +233,14 @@ def split():
             targetf = "{}_{:03d}{}".format(fbase, i, ".hdf5")
             print("Cutting {} to {} => {}".format(tprev, t, targetf))
             # cut between tprev and t
+            segments.append((targetf, tprev, t))
 
-            sub = bio.copy()
-            sub.crop(tprev, t)
-            sub.meta["filename"] = targetf
+        tprev = t
 
-            # Write file to hdf5 copy
-            sub.save(targetf)
+    # Write all segments while reading through the data once
+    from biobabel.save_hdphysio5 import write_segments
 
-        tprev = t
+    write_segments(bio, segments)
 
 
 def merge():
@@ -200,6 +254,19 @@ def merge():
     )
     parser.add_argument("infile", nargs="+", help="The files to include in the merge.")
     parser.add_argument("outfile", help="The output file name.")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of input files to load in parallel.",
+    )
+    parser.add_argument(
+        "-c",
+        "--concat",
+        action="store_true",
+        help="Concatenate channels with the same ID in time, rather than putting the channels of all files side by side.",
+    )
     parser.add_argument(
         "-v",
         "--version",
@@ -223,20 +290,15 @@ def merge():
     print("Input files: {}".format(",".join(infs)))
     print("Output file: {}".format(outf))
 
-    inputs = []
-    for inf in infs:
-        bio = biobabel.io.load(inf)
-        if bio:
-            inputs.append(bio)
-        else:
-            sys.exit(-1)
-
-    merged = Biodata()  # create a new object
-    for bio in inputs:
-        merged.merge(bio)
+    # Write each file to the output as it is loaded, so that we never hold all of them in memory
+    from biobabel.save_hdphysio5 import merge_files
 
-    merged.print()
-    merged.save(outf)
+    try:
+        merge_files(infs, outf, concat=args.concat, workers=args.workers)
+    except (ValueError, OSError) as e:
+        print("### ERROR, could not merge: {}".format(e))
+        sys.exit(-1)
+    biobabel.io.load(outf, lazy=True).print()
 
 
 HTML_CSS_STYLE = """
@@ -278,10 +340,39 @@ HTML_CSS_STYLE = """
 """
 
 
+def report_fragment(inf, imgdir=None):
+    """
+    Produce the HTML report of a single file, as used by html_report().
+    Returns the HTML and the list of image files written, or None if the file could not be loaded.
+
+    inf : the file to report on
+    imgdir : if given, write the images to this directory rather than embedding them in the HTML
+    """
+    import hashlib
+    import os
+
+    print("==> {}".format(inf))
+    bio = biobabel.io.load(inf, lazy=True)
+    if not bio:
+        return None
+    imgname = hashlib.sha1(os.path.abspath(inf).encode()).hexdigest()[:12]
+    images = []
+    h = bio.html_report(imgdir=imgdir, imgname=imgname, images=images)
+    return h, images
+
+
+def use_agg():
+    # Render without a display (in html_report and its worker processes)
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
 def html_report():
     """
     Create an user friendly report giving an overview of a whole series of physiology files at once.
     """
+    import os
 
     parser = argparse.ArgumentParser(
         description="Produce a quick overview of a range of physiology files."
@@ -289,6 +380,24 @@ def html_report():
     parser.add_argument(
         "filename", nargs="+", help="The files to include in the report."
     )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="The number of files to render in parallel.",
+    )
+    parser.add_argument(
+        "-i",
+        "--images",
+        action="store_true",
+        help="Write the plots as separate image files (in report_files/) rather than embedding them in the HTML.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Render every file again, even if it has not changed since the last report.",
+    )
     parser.add_argument(
         "-v",
         "--version",
@@ -303,16 +412,55 @@ def html_report():
     infs = args.filename
     print("Input files: {}".format(",".join(infs)))
 
-    html = ""
+    imgdir = "report_files" if args.images else None
+
+    # Re-use the report of files that have not changed since they were last rendered
+    import biobabel.cache
+
+    fragments = {}
+    keys = {}
     for inf in infs:
-        print()
-        print("==> {}".format(inf))
-        bio = biobabel.io.load(inf)
-        if bio:
-            h = bio.html_report()
-            html += '<h1><a id="{}">{}</a></h1><p>{}</p>'.format(inf, inf, h)
-        else:
+        if not os.path.exists(inf):
+            print("File {} does not seem to exist.".format(inf))
             sys.exit(-1)
+        keys[inf] = biobabel.cache.cache_key(
+            inf,
+            "html",
+            {"imgdir": imgdir and os.path.abspath(imgdir), "cwd": os.getcwd()},
+        )
+        if args.no_cache:
+            continue
+        frag = biobabel.cache.lookup_json(keys[inf])
+        if frag and all(os.path.exists(f) for f in frag["images"]):
+            fragments[inf] = frag["html"]
+
+    todo = [inf for inf in infs if inf not in fragments]
+    print(
+        "Rendering {} file(s), {} unchanged since the last report.".format(
+            len(todo), len(infs) - len(todo)
+        )
+    )
+    if args.workers > 1 and len(todo) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=args.workers, initializer=use_agg
+        ) as ex:
+            results = list(ex.map(report_fragment, todo, [imgdir] * len(todo)))
+    else:
+        use_agg()
+        results = [report_fragment(inf, imgdir) for inf in todo]
+
+    for inf, res in zip(todo, results):
+        if res is None:
+            sys.exit(-1)
+        h, images = res
+        fragments[inf] = h
+        biobabel.cache.store_json({"html": h, "images": images}, keys[inf], inf)
+
+    html = ""
+    for inf in infs:
+        html += '<h1><a id="{}">{}</a></h1><p>{}</p>'.format(inf, inf, fragments[inf])
 
     ## Add header
 
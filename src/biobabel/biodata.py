@@ -1,6 +1,84 @@
 import numpy as np
-import h5py
-import time
+
+
+# By default, plot() reduces signals to this many points
+PLOT_MAX_POINTS = 5000
+
+# Header fields for which we keep a secondary index, so that
+# find_channels() on these does not need to scan all channels.
+INDEXED_KEYS = ("participant", "modality")
+
+
+def sample_range(SR, n, tfrom=None, tend=None):
+    """
+    Find the range of samples that fall strictly between two time points.
+
+    :param SR: float, the sampling rate
+    :param n: int, the number of samples
+    :param tfrom: float, the start time (exclusive), or None to start at the beginning
+    :param tend: float, the end time (exclusive), or None to go until the end
+    :returns: (start,stop) such that samples start..stop-1 have time tfrom < t < tend
+    :rtype: (int,int)
+
+    This gives the same samples as selecting (t > tfrom) & (t < tend) on a full time vector,
+    without creating one.
+    """
+    start, stop = 0, n
+    if tfrom is not None:
+        start = int(np.clip(np.floor(tfrom * SR), -1, n)) + 1
+        # Correct for rounding, so that we match t=i/SR exactly
+        while start > 0 and (start - 1) / SR > tfrom:
+            start -= 1
+        while start < n and start / SR <= tfrom:
+            start += 1
+        start = min(start, n)  # tfrom may lie beyond the end
+    if tend is not None:
+        stop = int(np.clip(np.ceil(tend * SR), 0, n))
+        while stop < n and stop / SR < tend:
+            stop += 1
+        while stop > 0 and (stop - 1) / SR >= tend:
+            stop -= 1
+    return start, max(start, stop)
+
+
+def envelope(vals, npoints):
+    """
+    Reduce a signal to at most npoints points for plotting, keeping its extremes.
+    The signal is divided into buckets of consecutive samples, and each bucket is
+    represented by its minimum and maximum, so that peaks and artifacts remain visible
+    (unlike when simply taking every n-th sample).
+
+    :param vals: one-dimensional array, the signal
+    :param npoints: int, the maximum number of points to return
+    :returns: (idx,env), the (fractional) sample positions and the values to be plotted
+    :rtype: (numpy.array,numpy.array)
+    """
+    vals = np.asarray(vals)
+    n = vals.shape[0]
+    if n <= npoints or npoints < 2:
+        return np.arange(n), vals
+    k = int(np.ceil(n / (npoints // 2)))  # samples per bucket
+    starts = np.arange(0, n, k)
+    idx = np.empty(2 * len(starts))
+    idx[0::2] = starts
+    idx[1::2] = np.minimum(starts + k / 2, n - 1)
+    env = np.empty(2 * len(starts), dtype=vals.dtype)
+    # fmin/fmax ignore NaN, so that a gap in the signal does not hide the rest of its bucket
+    env[0::2] = np.fmin.reduceat(vals, starts)
+    env[1::2] = np.fmax.reduceat(vals, starts)
+    return idx, env
+
+
+def readonly_view(dat):
+    """
+    Return a read-only view of a data array, sharing its memory.
+    Objects that are not numpy arrays (such as lazily read HDF5 channels) are returned as-is.
+    """
+    if not isinstance(dat, np.ndarray):
+        return dat
+    view = dat.view()
+    view.flags.writeable = False
+    return view
 
 
 class Biodata:
@@ -18,9 +96,65 @@ class Biodata:
         """Clear all data currently in the object"""
         self.date = ""
         self.channels = []
-        self.markers = {}
+        self.markers = {}  # marker name to sorted array of time points
+        self.marker_labels = {}  # marker name to array of labels (optional)
+        self.marker_durations = {}  # marker name to array of durations (optional)
         self.meta = {}  # miscellaneous metadata
         self.name = ""
+        self._shared = set()  # IDs of channels whose data is shared with a copy (see copy())
+        self._reindex()
+
+    # Channel index
+
+    def _reindex(self):
+        """
+        Rebuild the channel lookup tables from scratch.
+
+        We keep a map from channel id to its position in self.channels
+        and, for each of INDEXED_KEYS, a map from header value to the list
+        of channel ids (in channel order) that have that value.
+        """
+        self._index = {}
+        self._secondary = {k: {} for k in INDEXED_KEYS}
+        for i in range(len(self.channels)):
+            self._index_channel(i)
+
+    def _index_channel(self, i):
+        """Add the channel at position i to the lookup tables."""
+        hdr = self.channels[i][0]
+        self._index[hdr["id"]] = i
+        for k in INDEXED_KEYS:
+            if k in hdr:
+                self._secondary[k].setdefault(hdr[k], []).append(hdr["id"])
+
+    def _check_index(self):
+        """
+        Make sure the lookup tables are in sync with self.channels,
+        in case the channel list was modified directly rather than through our methods.
+        """
+        if len(self._index) != len(self.channels):
+            self._reindex()
+
+    def _position(self, chid):
+        """
+        Return the position of a channel in self.channels, or None if there is no such channel.
+
+        Besides the check in _check_index(), we verify that the channel found really has
+        the requested id, since the list may have been reordered or an id edited in place.
+        On a mismatch or a miss, the index is rebuilt and we look again.
+        """
+        self._check_index()
+        i = self._index.get(chid, None)
+        if i is not None and i < len(self.channels) and self.channels[i][0]["id"] == chid:
+            return i
+        self._reindex()
+        return self._index.get(chid, None)
+
+    def _append_channel(self, hdr, dat):
+        """Append a channel whose id is known to be unique and keep the index up to date."""
+        self._check_index()
+        self.channels.append((hdr, dat))
+        self._index_channel(len(self.channels) - 1)
 
     def summarize_meta(self):
         # Pretty printing courtesy of
@@ -68,12 +202,12 @@ class Biodata:
 
         If ident is already unique, it will be returned.
         """
-        ids = self.find_channels()
-        if ident not in ids:
+        self._check_index()
+        if ident not in self._index:
             return ident
         cnt = 1
         newid = "{}.{}".format(ident, cnt)
-        while newid in self.find_channels():
+        while newid in self._index:
             cnt += 1
             newid = "{}.{}".format(ident, cnt)
         return newid
@@ -90,7 +224,7 @@ class Biodata:
             "/", "_"
         )  # slashes don't work because HDF5 gets confused
         hdr["id"] = self.uniquefy(newid)  # make the ID unique in case it already exists
-        self.channels.append((hdr, dat))
+        self._append_channel(hdr, dat)
 
     def find(self, crit={}):
         """
@@ -121,15 +255,50 @@ class Biodata:
         .. code-block:: python
 
            biodata.find_channels({'modality':'ecg'}) # will return all channel IDs for channels whose modality equals ecg
+
+        Criteria on the channel id, participant and modality are looked up in an index
+        rather than by going through all channels.
         """
+        self._check_index()
+
+        # Narrow down the candidates using the index where we can
+        candidates = None
+        for k in crit:
+            if crit[k] is None:
+                continue  # matches channels lacking the key, which the index does not track
+            try:
+                if k == "id":
+                    found = [crit[k]] if crit[k] in self._index else []
+                elif k in self._secondary:
+                    found = self._secondary[k].get(crit[k], [])
+                else:
+                    continue
+            except TypeError:
+                continue  # unhashable criterion, fall back to checking every channel
+            if candidates is None or len(found) < len(candidates):
+                candidates = found
+
+        if candidates is None:
+            candidates = [hdr["id"] for hdr, _ in self.channels]
+
+        if any(
+            self._index.get(ch, len(self.channels)) >= len(self.channels)
+            or self.channels[self._index[ch]][0]["id"] != ch
+            for ch in candidates
+        ):
+            # The index is out of date (see _position()), so start again from a fresh one
+            self._reindex()
+            return self.find_channels(crit)
+
         chans = []
-        for hdr, _ in self.channels:
+        for ch in candidates:
+            hdr = self.channels[self._index[ch]][0]
             ok = True
             for k in crit:
                 if hdr.get(k, None) != crit[k]:
                     ok = False
             if ok:
-                chans.append(hdr["id"])
+                chans.append(ch)
         return chans
 
     def get_participants(self):
@@ -139,11 +308,8 @@ class Biodata:
         :returns: a list of participant IDs
         :rtype: str list
         """
-        part = []
-        for hdr, _ in self.channels:
-            p = hdr.get("participant", None)
-            if p and p not in part:
-                part.append(p)
+        self._check_index()
+        part = [p for p in self._secondary["participant"] if p]
         part.sort()
         return part
 
@@ -154,23 +320,29 @@ class Biodata:
         :param chid: str, the channel ID
         :returns: (hdr,dat) tuple containing the header and data for the given channel, respectively.
         """
-        for hdr, dat in self.channels:
-            if hdr.get("id", None) == chid:
-                return hdr, dat
+        i = self._position(chid)
+        if i is not None:
+            return self.channels[i]
         print("Could not find channel {}".format(chid))
         return None, None
 
-    def get_time(self, chid):
+    def get_time(self, chid, start=0, stop=None):
         """
         Given a channel, reproduce a time vector
 
         :param chid: str, the channel ID
-        :returns: a list of timestamps of the same length as the data, starting at zero.
+        :param start: int, the first sample for which we want the time
+        :param stop: int, one beyond the last sample for which we want the time, or None to go until the end
+        :returns: a list of timestamps of the same length as the data (or the samples start..stop-1), starting at zero.
         :rtype: numpy.array of floats
 
+        Since channels are sampled uniformly, the time of sample i is simply i/SR.
+        For long recordings, it is best to only ask for the samples you need.
         """
         hdr, dat = self.get(chid)
-        t = np.arange(dat.shape[0]) / hdr["sampling_frequency"]
+        if stop is None:
+            stop = dat.shape[0]
+        t = np.arange(start, stop) / hdr["sampling_frequency"]
         return t
 
     def get_closest_sample(self, chid, t):
@@ -267,7 +439,13 @@ class Biodata:
         print(summ)
 
     def plot(
-        self, channels=None, figsize=(12, 7), timerange=None, show=True, markers=True
+        self,
+        channels=None,
+        figsize=(12, 7),
+        timerange=None,
+        show=True,
+        markers=True,
+        max_points=PLOT_MAX_POINTS,
     ):
         """
         Produce a simple inspection plot of the entirety of the data.
@@ -278,6 +456,7 @@ class Biodata:
         :param timerange: a tuple indicating the start and end times of the desired plot time range, or None to plt all
         :param show: bool,  whether to call plot.show() or not when completed
         :param markers: whether to draw tempoeral position of embedded markers
+        :param max_points: int, longer signals are reduced to this many points (see envelope()) before plotting, or None to plot every sample
 
         """
 
@@ -310,26 +489,44 @@ class Biodata:
         for i, chan in enumerate(chans):
             ax = axs[i][0]
             hdr, vals = self.get(chan)
-            t = self.get_time(chan)
+            SR = hdr["sampling_frequency"]
+            n = vals.shape[0]
             tmin, tmax = -np.inf, np.inf
             if timerange:
                 (tmin, tmax) = timerange
-            tsels = (t >= tmin) & (t <= tmax)
-            if sum(tsels) == 0:
+            # Find the samples with tmin <= t <= tmax, without making a time vector for the whole channel
+            start, stop = sample_range(SR, n, tmin, tmax)
+            if start > 0 and (start - 1) / SR == tmin:
+                start -= 1
+            if stop < n and stop / SR == tmax:
+                stop += 1
+            if stop <= start:
                 continue
-            t = t[tsels]
-            vals = vals[tsels]
+            vals = np.asarray(vals[start:stop])
+            if max_points:
+                idx, vals = envelope(vals, max_points)
+                t = (start + idx) / SR
+            else:
+                t = self.get_time(chan, start, stop)
 
             col = COLORS[i]
             ax.plot(t, vals, color=col)
             ax.set_title(chan)
 
             if markers:
-                for m in self.get_markers():
-                    evs = self.get_marker(m)
-                    for t in evs:
-                        if t >= tmin and t <= tmax:
-                            ax.axvline(x=t, dashes=[2, 2], color="gray")
+                evs = np.concatenate(
+                    [np.empty(0)]
+                    + [self.get_marker(m, tmin, tmax) for m in self.get_markers()]
+                )
+                if len(evs):
+                    ax.vlines(
+                        evs,
+                        0,
+                        1,
+                        transform=ax.get_xaxis_transform(),
+                        linestyles=(0, (2, 2)),
+                        colors="gray",
+                    )
 
             # Simplify axes
             ax.spines["top"].set_visible(False)
@@ -343,15 +540,19 @@ class Biodata:
 
         return f
 
-    def html_report(self):
+    def html_report(self, imgdir=None, imgname="plot", images=None):
         """
         Return a simple quick-and-dirty HTML rendition of the data.
 
-        :return: standalone HTML code containing base64-encoded images
+        :param imgdir: str, if given, the plots are written as image files to this directory and linked to (using this path), instead of being embedded in the HTML
+        :param imgname: str, the file name prefix of the images written to imgdir
+        :param images: list, if given, the paths of the image files written are appended to it
+        :return: HTML code containing base64-encoded images (or links to the image files)
         :rtype: str
         """
         import base64
         import io
+        import os
         import matplotlib.pyplot as plt
 
         html = ""
@@ -369,20 +570,32 @@ class Biodata:
             tranges.append((hd, hd + MINI_WINDOW_SIZE))
             tranges.append((dur - MINI_WINDOW_SIZE, dur))
 
-        for trange in tranges:
+        if imgdir:
+            os.makedirs(imgdir, exist_ok=True)
+
+        for i, trange in enumerate(tranges):
             f = self.plot(
                 timerange=trange,
                 show=False,
                 markers=(trange != None),
                 figsize=(12, 7) if trange is None else (8, 5),
             )
-            pic_IObytes = io.BytesIO()
-            plt.savefig(pic_IObytes, format="jpg")
-            pic_IObytes.seek(0)
-            b64 = base64.b64encode(pic_IObytes.read())
-            html += '<p><img src="data:image/jpeg;base64,{}"></p>'.format(
-                b64.decode("utf-8")
-            )
+            if imgdir:
+                imgf = os.path.join(imgdir, "{}_{}.jpg".format(imgname, i))
+                plt.savefig(imgf, format="jpg")
+                if images is not None:
+                    images.append(imgf)
+                html += '<p><img src="{}" loading="lazy"></p>'.format(
+                    imgf.replace(os.sep, "/")
+                )
+            else:
+                pic_IObytes = io.BytesIO()
+                plt.savefig(pic_IObytes, format="jpg")
+                pic_IObytes.seek(0)
+                b64 = base64.b64encode(pic_IObytes.read())
+                html += '<p><img src="data:image/jpeg;base64,{}"></p>'.format(
+                    b64.decode("utf-8")
+                )
             plt.close()
 
         return html
@@ -397,10 +610,24 @@ class Biodata:
         :param new_id: str, the desired new channel ID.
 
         """
-        for hdr, _ in self.channels:
-            if hdr["id"] == old_id:
-                hdr["id"] = new_id
-                return
+        i = self._position(old_id)
+        if i is not None:
+            hdr = self.channels[i][0]
+            hdr["id"] = new_id
+            del self._index[old_id]
+            self._index[new_id] = i
+            if old_id in self._shared:
+                self._shared.discard(old_id)
+                self._shared.add(new_id)
+            try:
+                for k in INDEXED_KEYS:
+                    if k in hdr:
+                        ids = self._secondary[k][hdr[k]]
+                        ids[ids.index(old_id)] = new_id
+            except (KeyError, ValueError):
+                # The header was changed behind our back, so start over
+                self._reindex()
+            return
         print("No channel found with ID {}".format(old_id))
         return
 
@@ -416,21 +643,42 @@ class Biodata:
         Any existing metadata will be overwritten.
 
         """
-        for hdr, _ in self.channels:
-            if hdr["id"] == ident:
-                for k in specs:
-                    # assert k!="id" # probably not safe to change channel ID that way
-                    hdr[k] = specs[k]
-                return  # We're done, there should be only one channel with that ID
+        i = self._position(ident)
+        if i is not None:
+            hdr = self.channels[i][0]
+            for k in specs:
+                # assert k!="id" # probably not safe to change channel ID that way
+                hdr[k] = specs[k]
+            if "id" in specs or any(k in specs for k in INDEXED_KEYS):
+                self._reindex()
+            return  # We're done, there should be only one channel with that ID
+        print("No channel found with ID {}. Nothing updated.".format(ident))
+        return
+
+    def update_data(self, ident, dat):
+        """
+        Replace the data of a particular channel, keeping its header.
+
+        :param ident: str, the channel ID to be modified
+        :param dat: the new data stream (a one-dimensional array)
+        """
+        i = self._position(ident)
+        if i is not None:
+            self.channels[i] = (self.channels[i][0], dat)
+            self._shared.discard(ident)  # this is now our own data
+            return
         print("No channel found with ID {}. Nothing updated.".format(ident))
         return
 
-    def crop(self, tfrom=None, tend=None):
+    def crop(self, tfrom=None, tend=None, copy=False):
         """
         Crop the data to a given time range.
 
         :param tfrom: float, number of seconds that should be clipped from the beginning of the data streams
         :param tend: float, the end point to which all data should be clipped.
+        :param copy: bool, if True, the cropped channels get their own copy of the data.
+                     By default they are views into the original arrays, which makes cropping
+                     nearly free but means that they share memory with the uncropped data.
 
         Example:
 
@@ -447,18 +695,26 @@ class Biodata:
             tend = np.inf
         newchannels = []
         for hdr, vals in self.channels:
-            chan = hdr["id"]
-            t = self.get_time(chan)
-            tincl = (t > tfrom) & (t < tend)
-            vals = vals[tincl]
+            # Channels are sampled uniformly, so the time range is a simple range of samples
+            start, stop = sample_range(
+                hdr["sampling_frequency"], vals.shape[0], tfrom, tend
+            )
+            vals = vals[start:stop]
+            if copy:
+                vals = np.array(vals)
             newchannels.append((hdr, vals))
         self.channels = newchannels  # replace
+        self._reindex()
 
         # Need to also update the markers!
-        for m in self.markers.keys():
-            mrk = self.markers[m]
-            self.markers[m] = [t - tfrom for t in mrk if t > tfrom and t < tend]
+        shift = tfrom if np.isfinite(tfrom) else 0  # if we don't cut the start, time zero stays where it is
+        for m in list(self.markers.keys()):
+            i, j = self.marker_range(m, tfrom, tend)
             # This (also) drops markers that are no longer in the current range
+            self.markers[m] = self.markers[m][i:j] - shift
+            for info in [self.marker_labels, self.marker_durations]:
+                if m in info:
+                    info[m] = info[m][i:j]
 
     def drop(self, what):
         """
@@ -479,6 +735,7 @@ class Biodata:
                 (hdr, vals) for (hdr, vals) in self.channels if hdr["id"] not in what
             ]
 
+        self._reindex()
         return self
 
     def select(self, what):
@@ -520,11 +777,19 @@ class Biodata:
                     newchan.append((hdr, vals))
             self.channels = newchan
 
+        self._reindex()
         return self
 
-    def copy(self):
+    def copy(self, cow=False):
         """
         Create a deep copy of this data object.
+
+        :param cow: bool, if True, make a copy-on-write copy instead. The data arrays are then not copied
+                    but shared between the two objects, which is much faster and takes no extra memory.
+                    Both objects then hold read-only views of the shared data, so that writing to it
+                    through get() raises an error rather than silently changing the other object.
+                    Use get_writable() (on either object) to modify a channel in place: this gives
+                    that object its own, writable copy of the channel the first time.
         """
 
         bio = Biodata()  # create a new biodata object
@@ -532,15 +797,48 @@ class Biodata:
         bio.name = self.name
         bio.meta = self.meta.copy()
 
-        for ch, dat in self.channels:
-            bio.channels.append((ch.copy(), dat.copy()))
+        if cow:
+            self.channels[:] = [(ch, readonly_view(dat)) for (ch, dat) in self.channels]
+            for ch, dat in self.channels:
+                bio._append_channel(ch.copy(), dat)
+            self._shared.update(self.find_channels())
+            bio._shared.update(bio.find_channels())
+        else:
+            for ch, dat in self.channels:
+                bio._append_channel(ch.copy(), dat.copy())
 
-        bio.markers = {}
+        bio.clear_markers()
         for m in self.get_markers():
-            bio.markers[m] = list(self.get_marker(m))
+            bio.add_marker(
+                m,
+                self.get_marker(m),
+                self.get_marker_labels(m),
+                self.get_marker_durations(m),
+            )
 
         return bio
 
+    def get_writable(self, chid):
+        """
+        Like get(), but makes sure that the data of the channel can be modified in place.
+        If the data is shared with another object (see copy()) or read-only (e.g. memory-mapped from a file),
+        the channel is given its own copy first.
+
+        :param chid: str, the channel ID
+        :returns: tuple of (header,data)
+        """
+        hdr, dat = self.get(chid)
+        if hdr is None:
+            return hdr, dat
+        if (
+            chid in self._shared
+            or not (isinstance(dat, np.ndarray) and dat.flags.writeable)
+            or isinstance(dat, np.memmap)
+        ):
+            dat = np.array(dat)
+            self.update_data(chid, dat)
+        return hdr, dat
+
     # Marker functionality
 
     def get_markers(self):
@@ -554,33 +852,132 @@ class Biodata:
         mrk.sort()
         return mrk
 
-    def get_marker(self, m):
+    def _marker_times(self, m):
         """
-        For a given marker, returns a list of time points stored under that marker.
+        Return the (sorted) array of time points of a marker.
+        Markers that were assigned directly as lists are converted on first use.
+        """
+        t = self.markers.get(m, None)
+        if t is None:
+            return np.empty(0)
+        if not (isinstance(t, np.ndarray) and t.dtype == float):
+            # Not stored by add_marker(), so make it a sorted array now
+            t = np.asarray(t, dtype=float).ravel()
+            order = np.argsort(t, kind="stable")
+            t = t[order]
+            self.markers[m] = t
+            for info in [self.marker_labels, self.marker_durations]:
+                if m in info:
+                    info[m] = np.asarray(info[m])[order]
+        return t
+
+    def marker_range(self, m, tfrom=None, tend=None, inclusive=False):
+        """
+        Find which events of a marker fall within a time range.
 
         :param m: str, the marker name
-        :returns: the list of time points indicated by that marker, in seconds.
-        :rtype: float list
+        :param tfrom: float, the start of the range, or None to start at the beginning
+        :param tend: float, the end of the range, or None to go until the end
+        :param inclusive: bool, whether events exactly at tfrom or tend are included
+        :returns: (i,j) such that events i..j-1 (in order of time) fall within the range
+        :rtype: (int,int)
+        """
+        t = self._marker_times(m)
+        i, j = 0, t.shape[0]
+        if tfrom is not None:
+            i = int(np.searchsorted(t, tfrom, side="left" if inclusive else "right"))
+        if tend is not None:
+            j = int(np.searchsorted(t, tend, side="right" if inclusive else "left"))
+        return i, max(i, j)
+
+    def get_marker(self, m, tfrom=None, tend=None):
+        """
+        For a given marker, returns the time points stored under that marker.
+
+        :param m: str, the marker name
+        :param tfrom: float, if given, only return time points from this time on
+        :param tend: float, if given, only return time points up to this time
+        :returns: the time points indicated by that marker, in seconds, in increasing order.
+        :rtype: numpy.array of floats
+        """
+        i, j = self.marker_range(m, tfrom, tend, inclusive=True)
+        return self._marker_times(m)[i:j]
+
+    def get_marker_labels(self, m):
         """
-        return self.markers.get(m, [])
+        Returns the labels of the events of a marker (in the same order as get_marker()), or None if they have none.
+        """
+        self._marker_times(m)
+        return self.marker_labels.get(m, None)
+
+    def get_marker_durations(self, m):
+        """
+        Returns the durations (in seconds) of the events of a marker (in the same order as get_marker()), or None if they have none.
+        """
+        self._marker_times(m)
+        return self.marker_durations.get(m, None)
 
-    def add_marker(self, m, timepoints):
+    def add_marker(self, m, timepoints, labels=None, durations=None):
         """
         Add a marker with a given label m and set of time points.
 
         :param m: str, the name of the marker to be added
         :param timepoints: float list, the time points (in seconds) indicated by this new marker. Or if only a single time point, can be entered as a single float.
+        :param labels: str list, optionally, a label for each time point
+        :param durations: float list, optionally, a duration (in seconds) for each time point
         """
-        if isinstance(timepoints, float):
+        if isinstance(timepoints, (float, int)):
             timepoints = [timepoints]
         if m in self.markers:
             print("### ERROR, marker {} to be added already exists.".format(m))
             assert False
-        self.markers[m] = timepoints
+        # We keep markers sorted, so that we can find time ranges quickly
+        t = np.asarray(timepoints, dtype=float).ravel()
+        order = np.argsort(t, kind="stable")
+        self.markers[m] = t[order]
+        if labels is not None:
+            self.marker_labels[m] = np.asarray(labels)[order]
+        if durations is not None:
+            self.marker_durations[m] = np.asarray(durations, dtype=float)[order]
+
+    def extend_marker(self, m, timepoints, labels=None, durations=None):
+        """
+        Add time points to a marker, creating it if it does not exist yet.
+
+        :param m: str, the name of the marker
+        :param timepoints: float list, the time points (in seconds) to be added
+        :param labels: str list, optionally, a label for each time point
+        :param durations: float list, optionally, a duration (in seconds) for each time point
+        """
+        if m not in self.markers:
+            return self.add_marker(m, timepoints, labels, durations)
+        t = np.asarray(timepoints, dtype=float).ravel()
+        old = self._marker_times(m)
+        oldlabels = self.marker_labels.pop(m, None)
+        olddurations = self.marker_durations.pop(m, None)
+        if labels is not None or oldlabels is not None:
+            # Events without a label get an empty one
+            labels = np.concatenate(
+                [
+                    oldlabels if oldlabels is not None else np.full(len(old), ""),
+                    labels if labels is not None else np.full(len(t), ""),
+                ]
+            )
+        if durations is not None or olddurations is not None:
+            durations = np.concatenate(
+                [
+                    olddurations if olddurations is not None else np.zeros(len(old)),
+                    durations if durations is not None else np.zeros(len(t)),
+                ]
+            )
+        del self.markers[m]
+        self.add_marker(m, np.concatenate([old, t]), labels, durations)
 
     def clear_markers(self):
         """Remove all markers"""
         self.markers = {}
+        self.marker_labels = {}
+        self.marker_durations = {}
 
     #
     #
@@ -606,7 +1003,12 @@ class Biodata:
 
         # Copy markers
         for m in other.get_markers():
-            self.add_marker(m, other.get_marker(m))
+            self.add_marker(
+                m,
+                other.get_marker(m),
+                other.get_marker_labels(m),
+                other.get_marker_durations(m),
+            )
 
         # Done!
         return self
@@ -618,59 +1020,62 @@ class Biodata:
     #
     #
 
-    def save(self, fname):
+    def save(
+        self,
+        fname,
+        compression=None,
+        compression_opts=None,
+        shuffle=False,
+        chunks=None,
+        dtype=None,
+    ):
         """
         Save current data file in hdphysio5 format
 
         :param fname: str, the filename of the file to be created.
+        :param compression: None, 'gzip' or 'lzf', the HDF5 compression filter to apply to the channels
+        :param compression_opts: the compression level (for gzip, 0-9)
+        :param shuffle: bool, whether to apply the HDF5 shuffle filter (typically improves compression)
+        :param chunks: int, number of samples per HDF5 chunk, or None to store uncompressed channels contiguously
+        :param dtype: the data type to store channels in. By default integer data is stored as is and everything else as single-precision float. Use "preserve" to store all data as is.
 
         At present, only saving in the native HDF5 is supported.
+
+        Example:
+
+        .. code-block:: python
+
+           biodata.save('archive.hdf5', compression='gzip', shuffle=True)
+
         """
+        from biobabel.save_hdphysio5 import Writer
 
         if not fname.lower().endswith(".hdf5"):
             print("Currently only saving in hdphysio5 format.")
             return
 
         # Go ahead and save
+        with Writer(
+            fname,
+            compression=compression,
+            compression_opts=compression_opts,
+            shuffle=shuffle,
+            chunks=chunks,
+            dtype=dtype,
+        ) as w:
+            if self.name:
+                w.set_name(self.name)
+            if self.date:
+                w.set_date(self.date)
+
+            w.write_meta(self.meta)
+            w.write_markers(
+                {m: self.get_marker(m) for m in self.get_markers()},
+                self.marker_labels,
+                self.marker_durations,
+            )
 
-        ## Create the HDF5 version
-        hf = h5py.File(fname, "w")
-        participants = self.get_participants()  # set participants attribute
-        if self.name:
-            hf.attrs["name"] = self.name
-        hf.attrs["participants"] = participants
-        if self.date:
-            hf.attrs["date"] = self.date
-        else:
-            hf.attrs["date"] = time.strftime("%m/%d/%Y %H:%M:%S %Z%z")
-
-        # Create an empty dataset to hold meta attributes
-        m = hf.create_dataset("meta", data=h5py.Empty("f"))
-        for k in self.meta:
-            m.attrs[k] = self.meta[k]
-
-        # Create the markers
-        eventtypes = self.get_markers()
-        if eventtypes:
-            hf.attrs["markers"] = eventtypes
-            for e in eventtypes:
-                evs = self.get_marker(e)
-                hf.attrs[e] = evs
-
-        # Add the data channels for each participant
-        for p in participants:
-            dat = hf.create_group(p)
-
-            # Find channels for this participant
-            chans = self.find_channels({"participant": p})
-            for chan in chans:
-                hdr, dat = self.get(chan)
-                modality = hdr["modality"]
-                sz = dat.shape[0]
-                dset = hf[p].create_dataset(chan, (sz,), dtype="f", data=dat)
-                dset.attrs["SR"] = hdr["sampling_frequency"]
-                dset.attrs["participant"] = p
-                dset.attrs["modality"] = modality
-                dset.attrs["units"] = hdr.get("units", "arbitrary")
-
-        hf.close()
+            # Add the data channels for each participant
+            for p in self.get_participants():
+                for chan in self.find_channels({"participant": p}):
+                    w.add_channel(self.get(chan))
@@ -0,0 +1,258 @@
+# On-disk cache of parsed files.
+#
+#   Parsing some formats (XDF dejittering, CSV sniffing, ACQ decoding) is slow.
+#   When asked to, we store the result in our native hdphysio5 format so that the
+#   next time the same file is opened, we only need to read an HDF5 file.
+#
+#   Entries are keyed on the absolute path, size and modification time of the source
+#   file, the dialect, loading options and the biobabel version, so that they
+#   are never used once the file (or biobabel) changes. When the cache grows beyond
+#   its maximum size, the least recently used entries are removed.
+#
+#   Besides parsed files, the cache also holds small JSON entries, such as the
+#   HTML report fragments of biohtml.
+
+import hashlib
+import json
+import os
+
+import biobabel
+
+# Bumped whenever the way we store cache entries changes
+CACHE_FORMAT_VERSION = 2
+
+DEFAULT_MAX_SIZE = 2 * 1024**3  # in bytes
+
+# Root attribute of cache entries that records which file they came from
+SOURCE_ATTR = "biobabel_cache_source"
+
+# Root attribute of cache entries with the original order of the channels
+# (hdphysio5 files group the channels by participant)
+ORDER_ATTR = "biobabel_channel_order"
+
+
+def get_cache_dir():
+    """
+    Return the directory where cached files are kept.
+    This is $BIOBABEL_CACHE_DIR if set, otherwise biobabel/ in the user cache directory.
+    """
+    d = os.environ.get("BIOBABEL_CACHE_DIR")
+    if not d:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        d = os.path.join(base, "biobabel")
+    return d
+
+
+def get_max_size():
+    """Return the maximum size of the cache in bytes ($BIOBABEL_CACHE_SIZE if set)."""
+    return int(os.environ.get("BIOBABEL_CACHE_SIZE", DEFAULT_MAX_SIZE))
+
+
+def cache_key(fname, dialect, options):
+    """
+    Compute the key under which a file is cached.
+
+    fname : the source file
+    dialect : the dialect it is loaded as
+    options : dict of loading options that affect the result (e.g. channels)
+    """
+    st = os.stat(fname)
+    ident = [
+        os.path.abspath(fname),
+        st.st_size,
+        st.st_mtime_ns,
+        dialect,
+        biobabel.__version__,
+        CACHE_FORMAT_VERSION,
+        options,
+    ]
+    return hashlib.sha1(json.dumps(ident, default=str).encode()).hexdigest()
+
+
+def lookup(key, ext=".hdf5"):
+    """Return the path of the cache entry for the given key, or None if there is none."""
+    path = os.path.join(get_cache_dir(), key + ext)
+    if os.path.exists(path):
+        os.utime(path)  # mark as recently used
+        return path
+    return None
+
+
+def store(bio, key, source):
+    """
+    Store a Biodata object in the cache under the given key.
+    Returns the path of the new entry, or None if it could not be stored.
+    """
+    import h5py
+
+    d = get_cache_dir()
+    os.makedirs(d, exist_ok=True)
+    path = os.path.join(d, key + ".hdf5")
+    tmp = "{}.{}.tmp.hdf5".format(path, os.getpid())
+    try:
+        bio.save(tmp, dtype="preserve")
+        with h5py.File(tmp, "a") as hf:
+            hf.attrs[SOURCE_ATTR] = os.path.abspath(source)
+            # Saving fills in the current time if there is no date, but a cache hit should give what the file has
+            hf.attrs["date"] = bio.date
+            if bio.channels:
+                hf.attrs[ORDER_ATTR] = bio.find_channels()
+        os.replace(tmp, path)  # so that others never see a half-written entry
+    except Exception as e:
+        print("Could not cache {}: {}".format(source, e))
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+    evict()
+    return path
+
+
+def load_entry(path, lazy=False):
+    """Load a cache entry, giving the same Biodata object as loading the original file."""
+    import h5py
+    import biobabel.load_hdphysio5
+
+    with h5py.File(path, "r") as hf:
+        order = list(hf.attrs.get(ORDER_ATTR, []))
+    bio = biobabel.load_hdphysio5.load(path, lazy=lazy)
+    if sorted(order) == sorted(bio.find_channels()):
+        pos = {chid: i for i, chid in enumerate(order)}
+        bio.channels.sort(key=lambda hdrdat: pos[hdrdat[0]["id"]])
+        bio._reindex()
+    return bio
+
+
+def lookup_json(key):
+    """Return the contents of the JSON cache entry for the given key, or None if there is none."""
+    path = lookup(key, ".json")
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # e.g. removed or half-written in the meantime
+
+
+def store_json(obj, key, source):
+    """
+    Store a JSON-serializable dict in the cache under the given key.
+    Returns the path of the new entry.
+    """
+    d = get_cache_dir()
+    os.makedirs(d, exist_ok=True)
+    path = os.path.join(d, key + ".json")
+    tmp = "{}.{}.tmp.json".format(path, os.getpid())
+    obj = dict(obj, source=os.path.abspath(source))
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+    evict()
+    return path
+
+
+def entries():
+    """
+    List the cache entries, least recently used first.
+
+    :returns: list of (path,size,last_used) tuples
+    """
+    d = get_cache_dir()
+    if not os.path.isdir(d):
+        return []
+    ents = []
+    for f in os.listdir(d):
+        if f.endswith((".hdf5", ".json")) and ".tmp." not in f:
+            path = os.path.join(d, f)
+            st = os.stat(path)
+            ents.append((path, st.st_size, st.st_mtime))
+    ents.sort(key=lambda e: e[2])
+    return ents
+
+
+def evict(max_size=None):
+    """Remove the least recently used entries until the cache is no larger than max_size bytes."""
+    if max_size is None:
+        max_size = get_max_size()
+    ents = entries()
+    total = sum(sz for (_, sz, _) in ents)
+    for path, sz, _ in ents:
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue  # somebody else removed it
+        total -= sz
+
+
+def clear():
+    """Remove all cache entries."""
+    evict(0)
+
+
+def get_source(path):
+    """Return the file that a cache entry was made from."""
+    import h5py
+
+    try:
+        if path.endswith(".json"):
+            with open(path) as f:
+                return json.load(f).get("source", "?")
+        with h5py.File(path, "r") as hf:
+            return hf.attrs.get(SOURCE_ATTR, "?")
+    except (OSError, ValueError):
+        return "?"
+
+
+def main():
+    """
+    Command line interface to inspect or clear the cache.
+    """
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Inspect or clear the biobabel cache of parsed files."
+    )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="info",
+        choices=["info", "list", "clear"],
+        help="info: show where the cache is and how large; list: also list the entries; clear: remove all entries.",
+    )
+    parser.add_argument(
+        "-v",
+        "--version",
+        action="version",
+        version="%(prog)s {version}".format(version=biobabel.__version__),
+    )
+    args = parser.parse_args()
+
+    if args.command == "clear":
+        n = len(entries())
+        clear()
+        print("Removed {} cached file(s) from {}".format(n, get_cache_dir()))
+        return
+
+    ents = entries()
+    total = sum(sz for (_, sz, _) in ents)
+    print("Cache directory : {}".format(get_cache_dir()))
+    print("Entries         : {}".format(len(ents)))
+    print(
+        "Size            : {:.1f} MB of at most {:.1f} MB".format(
+            total / 1e6, get_max_size() / 1e6
+        )
+    )
+    if args.command == "list":
+        for path, sz, used in reversed(ents):
+            print(
+                "{}  {:8.1f} MB  {}".format(
+                    time.strftime("%Y/%m/%d %H:%M", time.localtime(used)),
+                    sz / 1e6,
+                    get_source(path),
+                )
+            )
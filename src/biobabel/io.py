@@ -1,22 +1,226 @@
-import biobabel.load_teensyecg
-import biobabel.load_hdphysio5
-import biobabel.load_lsl
-import biobabel.load_acq
-import biobabel.load_opensignals
-import biobabel.load_bramsbiobox
-import biobabel.load_genericcsv
-import biobabel.load_bdf
-import biobabel.load_edf
-
+import importlib
+import inspect
 import os
+import re
+import struct
+
+
+#
+#
+#
+# Registry of dialects (file formats) that we know how to read.
+#
+#   Each dialect has a loader, given as "module:function" so that the module
+#   (and the packages it depends on, such as pandas or pyxdf) is only imported
+#   once a file of that dialect is actually loaded.
+#
+#
+
+DIALECTS = {}  # dialect name to its specification (a dict)
+
+# How many bytes from the start of a file we read to figure out its dialect
+PROBE_BYTES = 4096
+
+# Group under which other packages can advertise their own dialects
+ENTRY_POINT_GROUP = "biobabel.dialects"
+
+
+def register_dialect(
+    name, loader, extensions=(), probe=None, description=None, magic=None
+):
+    """
+    Make a dialect (file format) known to biobabel.
+
+    :param name: str, the name of the dialect (as used for the `dialect` argument of load())
+    :param loader: the function that loads a file of this dialect and returns a Biodata object, or a string "module:function" pointing to it, which is only imported when needed.
+    :param extensions: list of str, the file extensions (such as ".acq") used for this dialect
+    :param probe: optional function that is given the first bytes of a file with one of the extensions, and returns True if the file appears to be of this dialect. Dialects sharing an extension are tried in the order in which they were registered.
+    :param description: str, human-readable name of the format, for file selection dialogs
+    :param magic: optional function that is given the first bytes of any file, and returns True if it recognizes the content as this dialect (regardless of extension). This should only match on distinctive signatures.
+
+    Other packages can register dialects through the `biobabel.dialects` entry point group,
+    where each entry point refers to a dict with the keys `loader`, `extensions`, `probe`, `magic` and `description`.
+    """
+    DIALECTS[name] = {
+        "name": name,
+        "loader": loader,
+        "extensions": [ext.lower() for ext in extensions],
+        "probe": probe,
+        "magic": magic,
+        "description": description,
+    }
+
+
+def get_loader(dialect):
+    """Return the load function for the given dialect, importing its module if necessary."""
+    load_plugins()
+    loader = DIALECTS[dialect]["loader"]
+    if isinstance(loader, str):
+        modname, funcname = loader.split(":")
+        loader = getattr(importlib.import_module(modname), funcname)
+        DIALECTS[dialect]["loader"] = loader
+    return loader
+
+
+_plugins_loaded = False
+
+
+def load_plugins():
+    """Register the dialects provided by other installed packages (only done once)."""
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return  # Python < 3.8
+    try:
+        eps = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        eps = entry_points().get(ENTRY_POINT_GROUP, [])  # Python < 3.10
+    for ep in eps:
+        try:
+            spec = ep.load()
+            register_dialect(ep.name, **spec)
+        except Exception as e:
+            print("Could not register dialect {} from {}: {}".format(ep.name, ep.value, e))
+
 
+def first_line_contains(*words):
+    """Return a probe that checks whether the first line of a file contains all the given words (case-insensitive)."""
 
-def load(fname, dialect=None):
+    def probe(head):
+        ln = head.split(b"\n", 1)[0].lower()
+        return all(ln.find(w.lower().encode()) > -1 for w in words)
+
+    return probe
+
+
+def is_hdf5(head):
+    # The HDF5 signature is at the start of the file, or after a user block of 512, 1024, 2048... bytes
+    sig = b"\x89HDF\r\n\x1a\n"
+    return any(head[i : i + len(sig)] == sig for i in [0, 512, 1024, 2048])
+
+
+def is_edf(head):
+    # The version field is "0" padded with spaces, followed (at byte 184) by the number of bytes in the header
+    return head[:8] == b"0       " and head[184:192].strip().isdigit()
+
+
+def is_bdf(head):
+    return head[:8] == b"\xffBIOSEMI"
+
+
+def is_xdf(head):
+    return head[:4] == b"XDF:"
+
+
+def is_acq(head):
+    # AcqKnowledge files have no signature, but start with a small file revision number
+    # (in either byte order) followed by a header length.
+    if len(head) < 10:
+        return False
+    for bom in "<>":
+        version, extlen = struct.unpack(bom + "ii", head[2:10])
+        if 30 <= version <= 255 and 0 < extlen < 2**20:
+            return True
+    return False
+
+
+def is_teensyecg(head):
+    return head.find(b"# Start signal received") > -1 or bool(
+        re.search(rb"\n[^ \n]* 0 raw -?\d+ ", head)
+    )
+
+
+register_dialect(
+    "hdphysio5",
+    "biobabel.load_hdphysio5:load",
+    [".hdf5"],
+    description="HDPhysio5 (HDF5)",
+    magic=is_hdf5,
+)
+register_dialect(
+    "lsl",
+    "biobabel.load_lsl:load",
+    [".xdf"],
+    description="Extensible Data Format (XDF)",
+    magic=is_xdf,
+)
+register_dialect(
+    "edf",
+    "biobabel.load_edf:load",
+    [".edf"],
+    description="European Data Format (EDF)",
+    magic=is_edf,
+)
+register_dialect(
+    "bdf",
+    "biobabel.load_bdf:load",
+    [".bdf"],
+    description="Biosemi Data Format (BDF)",
+    magic=is_bdf,
+)
+register_dialect(
+    "opensignals",
+    "biobabel.load_opensignals:load",
+    [".txt"],
+    probe=first_line_contains("OpenSignals"),
+    description="Text file (TXT)",
+    magic=first_line_contains("# OpenSignals"),
+)
+register_dialect(
+    "bramsbiobox",
+    "biobabel.load_bramsbiobox:load",
+    [".csv"],
+    probe=first_line_contains("time(ms)", "xaccel", "gauge"),
+    magic=first_line_contains("time(ms)", "xaccel", "gauge"),
+)
+register_dialect(
+    "teensyecg", "biobabel.load_teensyecg:load", [".txt"], magic=is_teensyecg
+)
+register_dialect(
+    "csv",
+    "biobabel.load_genericcsv:load",
+    [".csv"],
+    description="Comma-separated values (CSV)",
+)
+# Last, because the check for this one is the least specific
+register_dialect(
+    "acq",
+    "biobabel.load_acq:load",
+    [".acq"],
+    description="Biopac Acqknowledge (ACQ)",
+    magic=is_acq,
+)
+
+
+def load(
+    fname,
+    dialect=None,
+    lazy=False,
+    streams=None,
+    channels=None,
+    tfrom=None,
+    tend=None,
+    cache=False,
+):
     """
     Load physiology signal file.
 
     fname : filename of the file to be read
     dialect : the file format. If None, the format is guessed
+    lazy : if True, defer reading channel data until it is accessed (only for hdphysio5, ignored otherwise)
+    streams : which streams to load from XDF files (see biobabel.load_lsl.load), ignored for other formats
+    channels : a channel ID or list of channel IDs to keep, or None to keep all
+    tfrom : if given, only keep data after this time (in s), as in Biodata.crop()
+    tend : if given, only keep data before this time (in s), as in Biodata.crop()
+    cache : if True, keep the parsed result in an on-disk cache (see biobabel.cache), so that
+            loading the same (unchanged) file again only requires reading an HDF5 file.
+
+    Where the format allows (EDF), only the requested channels and time range are read
+    from the file. For other formats, everything is read and then cut down.
     """
 
     if not os.path.exists(fname):
@@ -29,90 +233,218 @@ def load(fname, dialect=None):
         if dialect:
             print("Guessed that this is {} format.".format(dialect))
 
-    if dialect == "teensyecg":
-        return biobabel.load_teensyecg.load(fname)
+    load_plugins()
+    if dialect not in DIALECTS:
+        return None  # did not manage to load
 
-    if dialect == "hdphysio5":
-        return biobabel.load_hdphysio5.load(fname)
+    if cache and dialect != "hdphysio5":  # no point in caching our own format
+        import biobabel.cache
 
-    if dialect == "lsl":
-        return biobabel.load_lsl.load(fname)
+        options = {"streams": streams, "channels": channels, "tfrom": tfrom, "tend": tend}
+        key = biobabel.cache.cache_key(fname, dialect, options)
+        path = biobabel.cache.lookup(key)
+        if path:
+            print("Reading from cache.")
+            return biobabel.cache.load_entry(path, lazy=lazy)
+        bio = load(fname, dialect, False, streams, channels, tfrom, tend)
+        if bio:
+            biobabel.cache.store(bio, key, fname)
+        return bio
 
-    if dialect == "acq":
-        return biobabel.load_acq.load(fname)
+    loader = get_loader(dialect)
 
-    if dialect == "opensignals":
-        return biobabel.load_opensignals.load(fname)
+    # Pass on the options that the loader supports
+    options = {
+        "lazy": lazy,
+        "streams": streams,
+        "channels": channels,
+        "tfrom": tfrom,
+        "tend": tend,
+    }
+    supported = inspect.signature(loader).parameters
+    kwargs = {k: v for k, v in options.items() if k in supported}
+    bio = loader(fname, **kwargs)
 
-    if dialect == "csv":
-        return biobabel.load_genericcsv.load(fname)
+    if streams is not None and "streams" not in supported:
+        print("Selecting streams is only supported for XDF files, loaded everything.")
 
-    if dialect == "bdf":
-        return biobabel.load_bdf.load(fname)
+    if bio and channels is not None and "channels" not in supported:
+        # The loader read everything, so drop what was not asked for
+        bio.select(channels if isinstance(channels, str) else list(channels))
 
-    if dialect == "edf":
-        return biobabel.load_edf.load(fname)
+    if bio and (tfrom is not None or tend is not None) and "tfrom" not in supported:
+        bio.crop(tfrom, tend)
 
-    if dialect == "bramsbiobox":
-        return biobabel.load_bramsbiobox.load(fname)
-
-    return None  # did not manage to load
+    return bio  # None if we did not manage to load
 
 
 def get_compatible_file_types():
     """Return a list of supported file types
     that can be fed to the open file dialog."""
-    ftps = [
-        ("Biopac Acqknowledge (ACQ)", ".acq"),
-        ("Extensible Data Format (XDF)", ".xdf"),
-        ("HDPhysio5 (HDF5)", ".hdf5"),
-        ("European Data Format (EDF)", ".edf"),
-        ("Comma-separated values (CSV)", ".csv"),
-        ("Text file (TXT)", ".txt"),
-    ]
+    load_plugins()
+    ftps = []
+    for d in DIALECTS.values():
+        if d["description"]:
+            for ext in d["extensions"]:
+                ftps.append((d["description"], ext))
     return [
         ("All biobabel compatible file types", " ".join([ext for (_, ext) in ftps]))
     ] + ftps
 
 
 def guess_dialect(fname):
+    """
+    Guess the dialect (file format) of a file.
 
-    if fname.lower().endswith(".bdf"):
-        return "bdf"  # guess
-    if fname.lower().endswith(".hdf5"):
-        return "hdphysio5"  # guess
-    if fname.lower().endswith(".xdf"):
-        return "lsl"  # guess
-    if fname.lower().endswith(".edf"):
-        return "edf"  # guess
-    if fname.lower().endswith(".acq"):
-        return "acq"  # guess
+    We read the first few bytes of the file (a fixed amount, however large the file is)
+    and look for the signatures of the formats we know. If none match, we go by the
+    file extension, looking at the contents where the extension is ambiguous.
+    """
+    load_plugins()
+    with open(fname, "rb") as f:
+        head = f.read(PROBE_BYTES)
 
-    if fname.lower().endswith(".txt"):
+    for d in DIALECTS.values():
+        if d["magic"] and d["magic"](head):
+            return d["name"]
 
-        # To guess the dialect, we have to actually probe the file itself
-        with open(fname) as f:
-            ln = f.readline()
+    _, ext = os.path.splitext(fname.lower())
+    for d in DIALECTS.values():
+        if ext in d["extensions"]:
+            if d["probe"] is None or d["probe"](head):
+                return d["name"]
 
-        if ln.find("OpenSignals") > -1:
-            return "opensignals"
+    return "csv"  # default is generic CSV
 
-        return "teensyecg"  # probably best to try
 
-    if fname.lower().endswith(".csv"):
+# Channels smaller than this (in bytes) are simply pickled when sent back from worker processes
+SHARED_MIN_BYTES = 2**16
 
-        # To guess the dialect, we have to actually probe the file itself
-        with open(fname) as f:
-            ln = f.readline().lower()
 
-        if (
-            ln.find("time(ms)") > -1
-            and ln.find("xaccel") > -1
-            and ln.find("gauge") > -1
-        ):
-            return "bramsbiobox"
+def load_many(paths, workers=None, executor="process", **kwargs):
+    """
+    Load several files concurrently.
 
-        else:
-            return "csv"  # generic CSV
+    :param paths: list of str, the files to be loaded
+    :param workers: int, the number of files to load at the same time (default: number of CPUs)
+    :param executor: 'process' to load in separate processes (best for formats whose parsing is CPU-bound), or 'thread' to load in threads of this process
+    :param kwargs: further arguments passed on to load(), e.g. dialect or channels
+    :returns: for each path (in the same order), the loaded Biodata object, or the exception that was raised while loading it (or None if the file did not exist)
+    :rtype: list
 
-    return "csv"  # default is generic CSV
+    When loading in separate processes, the channel data is passed back through
+    shared memory rather than being pickled.
+
+    Example:
+
+    .. code-block:: python
+
+       bios = biobabel.load_many(glob.glob('study/*.acq'), workers=8)
+
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    paths = list(paths)
+    if workers == 1 or len(paths) < 2:
+        return [load_or_error(p, kwargs) for p in paths]
+
+    if executor == "thread":
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            return list(ex.map(load_or_error, paths, [kwargs] * len(paths)))
+
+    if executor != "process":
+        raise ValueError("Unknown executor '{}', use 'process' or 'thread'.".format(executor))
+
+    use_shm = os.name == "posix"
+    if use_shm:
+        # Make sure the worker processes share our resource tracker, which is
+        # what keeps track of (and cleans up) shared memory blocks.
+        from multiprocessing import resource_tracker
+
+        resource_tracker.ensure_running()
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        results = list(
+            ex.map(
+                load_in_worker, paths, [kwargs] * len(paths), [use_shm] * len(paths)
+            )
+        )
+    return [from_shared(res) for res in results]
+
+
+def load_or_error(fname, kwargs):
+    """Load a file, returning the exception rather than raising it if something goes wrong."""
+    try:
+        return load(fname, **kwargs)
+    except Exception as e:
+        return e
+
+
+def load_in_worker(fname, kwargs, use_shm):
+    """Load a file in a worker process, and prepare it to be sent back (see to_shared)."""
+    bio = load_or_error(fname, kwargs)
+    if use_shm and bio is not None and not isinstance(bio, Exception):
+        to_shared(bio)
+    return bio
+
+
+def to_shared(bio):
+    """
+    Move the larger channels of a Biodata object into shared memory blocks,
+    replacing the data by a reference ("shm", name, dtype, shape) to the block.
+    """
+    import numpy as np
+    from multiprocessing.shared_memory import SharedMemory
+
+    for i, (hdr, dat) in enumerate(bio.channels):
+        arr = np.asarray(dat)
+        if arr.nbytes < SHARED_MIN_BYTES:
+            bio.channels[i] = (hdr, np.array(arr))
+            continue
+        shm = SharedMemory(create=True, size=arr.nbytes)
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        bio.channels[i] = (hdr, ("shm", shm.name, arr.dtype.str, arr.shape))
+        shm.close()
+
+
+def from_shared(bio):
+    """
+    The reverse of to_shared: replace the references to shared memory blocks by arrays
+    that use those blocks directly, without copying the data.
+
+    The names of the blocks are removed right away, so that the memory is given back
+    to the system as soon as the arrays (and any views of them) are no longer used.
+    """
+    if bio is None or isinstance(bio, Exception):
+        return bio
+
+    import numpy as np
+    from multiprocessing.shared_memory import SharedMemory
+
+    for i, (hdr, dat) in enumerate(bio.channels):
+        if isinstance(dat, tuple) and dat and dat[0] == "shm":
+            _, name, dtype, shape = dat
+            shm = SharedMemory(name=name)
+            shm.unlink()  # the block stays mapped until we close it
+            bio.channels[i] = (hdr, np.asarray(SharedArray(shm, shape, dtype)))
+    return bio
+
+
+class SharedArray:
+    """
+    Holds on to a shared memory block for as long as an array using it exists.
+
+    np.asarray() of this object gives an array of the block's data whose base is this
+    object, so that the block is closed once the array and all its views are gone.
+    """
+
+    def __init__(self, shm, shape, dtype):
+        import numpy as np
+
+        self._view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self._shm = shm
+        self.__array_interface__ = self._view.__array_interface__
+
+    def __del__(self):
+        self._view = None  # release our hold on the buffer, so that the block can be closed
+        self._shm.close()
@@ -40,12 +40,14 @@ def load(fname):
         dat = ch.data
         bio.add_channel((hdr, np.array(dat)))
 
-    bio.markers = {}
+    markers = {}
     for m in data.event_markers:
         tp = str(m.type)
         idx = m.sample_index
         t = idx / ch.samples_per_second
-        bio.markers[tp] = bio.markers.get(tp, []) + [t]  # Append the marker
+        markers.setdefault(tp, []).append(t)  # Append the marker
+    for tp in markers:
+        bio.add_marker(tp, markers[tp])
 
     # bio.markers = {}
     # for m in hf.attrs.get('markers',[]):
@@ -1,4 +1,5 @@
 import biobabel
+from biobabel.biodata import sample_range
 import numpy as np
 import os
 import datetime
@@ -7,12 +8,25 @@ import datetime
 import pyedflib
 
 
-def load(fname):
-    """Load EDF file."""
+def load(fname, channels=None, tfrom=None, tend=None):
+    """
+    Load EDF file.
+
+    fname : filename of the file to be read
+    channels : a channel label or list of labels to read, or None to read all
+    tfrom : if given, only read samples after this time (in s)
+    tend : if given, only read samples before this time (in s)
+
+    Only the requested signals and sample ranges are read from the file,
+    with the same result as reading everything and then calling select() and crop().
+    """
 
     bio = biobabel.Biodata()  # create a new biodata object
     bio.name = fname
 
+    if isinstance(channels, str):
+        channels = [channels]
+
     h = pyedflib.highlevel.read_edf_header(fname)
 
     # Fill in time stamp
@@ -32,23 +46,33 @@ def load(fname):
 
     # Start reading data
     f = pyedflib.EdfReader(fname)
-    n = f.signals_in_file
-    signal_labels = f.getSignalLabels()
-
-    assert n == len(headers)
-
-    for i, head in enumerate(headers):
-
-        SR = head["sample_rate"]
-        lab = signal_labels[i]
-        hdr = {
-            "id": lab,
-            "participant": participant,
-            "sampling_frequency": SR,
-            "modality": biobabel.guess_modality(lab),
-            "units": head.get("dimension", "unknown"),
-        }
-        dat = f.readSignal(i)
-        bio.add_channel((hdr, np.array(dat)))
+    try:
+        n = f.signals_in_file
+        signal_labels = f.getSignalLabels()
+
+        assert n == len(headers)
+
+        for i, head in enumerate(headers):
+
+            # Newer versions of pyedflib call this sample_frequency
+            SR = head.get("sample_frequency", head.get("sample_rate"))
+            lab = signal_labels[i]
+            if channels is not None and not (
+                lab in channels or lab.replace("/", "_") in channels
+            ):
+                continue  # not asked for, so don't read it
+
+            hdr = {
+                "id": lab,
+                "participant": participant,
+                "sampling_frequency": SR,
+                "modality": biobabel.guess_modality(lab),
+                "units": head.get("dimension", "unknown"),
+            }
+            start, stop = sample_range(SR, f.getNSamples()[i], tfrom, tend)
+            dat = f.readSignal(i, start, stop - start)
+            bio.add_channel((hdr, np.array(dat)))
+    finally:
+        f.close()
 
     return bio
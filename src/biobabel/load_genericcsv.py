@@ -3,6 +3,8 @@ import numpy as np
 import os
 import datetime
 import pandas as pd
+import csv
+import io
 
 
 #
@@ -12,36 +14,165 @@ import pandas as pd
 #
 #   Basically what we try to do is guess as much as possible.
 #
+#   To keep things fast on large files, the guessing (delimiter, header, column types)
+#   is done on the first few kilobytes only, and the file as a whole is then read
+#   with the fast (C) parser of pandas.
+#
 #
 
 
-def guess_time_column(dat):
-    # Given a table with some columns, guess which one might be the time column
-    # Return the name of the column, and time divider
-    for col in dat.columns:
+# How many bytes from the start of the file we look at to guess its format
+SNIFF_BYTES = 64 * 1024
 
-        # See if this could be a time column
-        vals = dat[col]
-        ds = np.diff(vals)
+CANDIDATE_DELIMITERS = ",;\t| "
 
-        # Check : values need to be increasing
-        if not min(ds) > 0:
-            continue
 
-        # Check : values need to increase by roughly the same amount each time
-        cv = np.std(ds) / np.mean(ds)
-        if cv > 0.1:
-            continue
+def is_number(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+def sniff(fname):
+    """
+    Guess the format of a CSV file from its first few kilobytes.
+
+    Returns a dict of arguments for pandas.read_csv (sep, header, names, usecols, dtype).
+    """
+    with open(fname, "r", errors="replace") as f:
+        sample = f.read(SNIFF_BYTES)
+    if len(sample) == SNIFF_BYTES and sample.rfind("\n") > 0:
+        sample = sample[: sample.rfind("\n")]  # drop the last, possibly incomplete line
+
+    try:
+        sep = csv.Sniffer().sniff(sample, delimiters=CANDIDATE_DELIMITERS).delimiter
+    except csv.Error:
+        sep = ","  # the sniffer failed, fall back on the most common delimiter
+
+    # The first row is a header if it has text where the next row has numbers
+    rows = csv.reader(io.StringIO(sample), delimiter=sep)
+    firstrow, secondrow = next(rows, []), next(rows, [])
+    header, names = None, ["column{}".format(i + 1) for i in range(len(firstrow))]
+    for a, b in zip(firstrow, secondrow):
+        if not is_number(a) and is_number(b):
+            header, names = 0, None
+            break
+
+    tab = pd.read_csv(
+        io.StringIO(sample), sep=sep, header=header, names=names, engine="c"
+    )
+
+    # Only keep the numeric columns, and read them as floats (so that missing values are allowed)
+    usecols = [col for col in tab.columns if pd.api.types.is_numeric_dtype(tab[col])]
+    dtype = {col: "float64" for col in usecols}
+    return {
+        "sep": sep,
+        "header": header,
+        "names": names,
+        "usecols": usecols,
+        "dtype": dtype,
+    }
+
+
+def read_table(fname, engine="c", chunksize=None):
+    """
+    Read a CSV file into a table (pandas DataFrame) of numeric columns.
+
+    fname : the file to be read
+    engine : the pandas parser engine, "c" or "pyarrow" (if installed)
+    chunksize : if given, read the file in chunks of this many rows
+    """
+    opts = sniff(fname)
+    try:
+        if chunksize and engine != "pyarrow":  # pyarrow does not do chunks
+            chunks = pd.read_csv(fname, engine=engine, chunksize=chunksize, **opts)
+            return pd.concat(chunks, ignore_index=True)
+        return pd.read_csv(fname, engine=engine, **opts)
+    except ValueError:
+        # Further down the file, a column contains something that is not a number.
+        # Read without enforcing types, and turn anything that is not a number into NaN.
+        del opts["dtype"]
+        tab = pd.read_csv(fname, engine=engine, **opts)
+        return tab.apply(pd.to_numeric, errors="coerce")
+
+
+# How many rows we look at (from the start, and spread across the file) to guess the time column
+TIME_SAMPLE_ROWS = 10000
+
+
+def looks_like_time(vals):
+    """
+    For each column of a two-dimensional array (rows are samples),
+    check whether it could be a time column: values need to be increasing,
+    and increase by roughly the same amount each time.
+    """
+    ds = np.diff(vals, axis=0)
+    if not ds.shape[0]:
+        return np.zeros(vals.shape[1], dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        increasing = np.min(ds, axis=0) > 0
+        cv = np.std(ds, axis=0) / np.mean(ds, axis=0)
+    return increasing & (cv <= 0.1)
+
 
-        # If we get this far it's looking pretty good!
-        print("Guessed '{}' is the time column.".format(col))
-        return col, 1000  # assume ms as default sampling unit
+def guess_time_column(dat):
+    """
+    Given a table with some columns, guess which one might be the time column.
+    Return the name of the column, and time divider.
+
+    Rather than going through every column in full, we check all columns at once
+    on a sample of rows (the first ones, and some spread out over the file).
+    Only the column that wins is then checked in full.
+    """
+    nrows = dat.shape[0]
+    step = max(1, nrows // TIME_SAMPLE_ROWS)
+    head = dat.iloc[:TIME_SAMPLE_ROWS].to_numpy(dtype="float64", na_value=np.nan)
+    spread = dat.iloc[::step].to_numpy(dtype="float64", na_value=np.nan)
+
+    candidates = looks_like_time(head) & looks_like_time(spread)
+    for i in np.flatnonzero(candidates):
+        col = dat.iloc[:, i].to_numpy(dtype="float64", na_value=np.nan)
+        if looks_like_time(col[:, None])[0]:
+            col = dat.columns[i]
+            print("Guessed '{}' is the time column.".format(col))
+            return col, 1000  # assume ms as default sampling unit
 
     return None, 1
 
 
-def load(fname):
-    """Load a file with CSV format."""
+def timing_stats(t, thresh=1.1):
+    """
+    Describe how regularly a time column is sampled.
+
+    t : the time stamps (in s)
+    thresh : time steps larger than this factor times the median step are counted as irregular
+
+    Returns a dict with the minimum, maximum, mean, median and SD of the time steps,
+    and the number of irregular (too large) time steps.
+    """
+    dt = np.diff(t)
+    mediandt = np.median(dt)
+    return {
+        "time_step_min": np.min(dt),
+        "time_step_max": np.max(dt),
+        "time_step_mean": np.mean(dt),
+        "time_step_median": mediandt,
+        "time_step_sd": np.std(dt),
+        "time_step_irregular_threshold": mediandt * thresh,
+        "time_step_irregular": int(np.sum(dt > mediandt * thresh)),
+    }
+
+
+def load(fname, engine="c", chunksize=None):
+    """
+    Load a file with CSV format.
+
+    fname : the file to be read
+    engine : the pandas parser engine, "c" or "pyarrow" (if installed)
+    chunksize : if given, read the file in chunks of this many rows
+    """
 
     print("Generic CSV load")
 
@@ -53,27 +184,18 @@ def load(fname):
     bio.meta["date"] = dt_m.strftime(biobabel.DATEFORMAT)
 
     ## gb['renames'] comes from the file configuration
-    tab = pd.read_csv(
-        fname, sep=None, engine="python"
-    )  # pandas will try to guess the delimiter, this might fail!
+    tab = read_table(fname, engine=engine, chunksize=chunksize)
 
     tcol, TIME_DIVIDER = guess_time_column(tab)
     if tcol:
 
         tab[tcol] = tab[tcol] / TIME_DIVIDER  # express in s
-        tdur = max(tab[tcol]) - min(tab[tcol])
-        dt = np.diff(tab[tcol])
-        mediandt = np.median(dt)
-        print("-- A human may want to inspect this:")
-        print(
-            "Time step values (in s) min={:.5f}, max={:.5f}, mean={:.5f}, median={:.5f}, SD={:.5f}".format(
-                np.min(dt), np.max(dt), np.mean(dt), mediandt, np.std(dt)
-            )
-        )
-        THRESH = mediandt * 1.1
-        print("# of time steps >.{}: {}".format(THRESH, np.sum(dt > THRESH)))
-        print("----")
-        print()
+
+        # Keep track of how regular the sampling is, for a human to inspect if need be
+        stats = timing_stats(tab[tcol].to_numpy())
+        for k in stats:
+            bio.add_meta(k, stats[k])
+        mediandt = stats["time_step_median"]
 
     else:
         # Create some defaults
@@ -8,8 +8,87 @@ import numpy as np
 import os
 import datetime
 
+from biobabel.save_hdphysio5 import LABELS_SUFFIX, DURATIONS_SUFFIX
 
-def load(fname):
+
+class H5Channel:
+    """
+    Array-like stand-in for a channel stored in an HDF5 dataset.
+    Data is only read from the file for the part that is actually indexed,
+    so that opening a large file does not load all of it into memory.
+    Converting it to a numpy array (e.g. np.array(x)) reads the whole channel.
+    """
+
+    def __init__(self, dset):
+        self.dset = dset
+
+    @property
+    def shape(self):
+        return self.dset.shape
+
+    @property
+    def dtype(self):
+        return self.dset.dtype
+
+    @property
+    def ndim(self):
+        return self.dset.ndim
+
+    @property
+    def size(self):
+        return self.dset.size
+
+    def __len__(self):
+        return self.dset.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, np.ndarray) and key.dtype == bool:
+            # A boolean mask, as used for selecting time ranges.
+            # If it selects a contiguous range, only read that range.
+            idx = np.flatnonzero(key)
+            if not len(idx):
+                return np.empty(0, dtype=self.dtype)
+            if idx[-1] - idx[0] + 1 == len(idx):
+                return self.dset[idx[0] : idx[-1] + 1]
+            return np.asarray(self)[key]
+        if isinstance(key, slice) and key.step is not None and key.step < 0:
+            return np.asarray(self)[key]  # h5py does not do reverse slicing
+        return self.dset[key]
+
+    def __array__(self, dtype=None, copy=None):
+        dat = self.dset[()]
+        if dtype is not None:
+            dat = dat.astype(dtype)
+        return dat
+
+    def copy(self):
+        return np.array(self)
+
+
+def open_channel(fname, dset):
+    """
+    Return a lazily-read version of the given dataset.
+    Contiguous, uncompressed datasets are memory-mapped directly,
+    other datasets are wrapped so that they are read on demand.
+    """
+    if dset.chunks is None and dset.compression is None and dset.size > 0:
+        offset = dset.id.get_offset()
+        if offset is not None:
+            return np.memmap(
+                fname, dtype=dset.dtype, mode="r", offset=offset, shape=dset.shape
+            )
+    return H5Channel(dset)
+
+
+def load(fname, lazy=False):
+    """
+    Load hdphysio5 file.
+
+    fname : filename of the file to be read
+    lazy : if True, the channel data is not read into memory right away,
+           but only once (and only the portion that) it is accessed.
+           The file is kept open as long as the data is in use.
+    """
 
     bio = biobabel.Biodata()  # create a new biodata object
 
@@ -50,12 +129,21 @@ def load(fname):
                 "sampling_frequency": SR,
                 "modality": mod,
             }
-            dat = np.array(dset[:])  # convert into numpy array just to be sure
+            if "units" in dset.attrs:
+                hdr["units"] = dset.attrs["units"]
+            if lazy:
+                dat = open_channel(fname, dset)
+            else:
+                dat = np.array(dset[:])  # convert into numpy array just to be sure
             bio.add_channel((hdr, dat))
 
-    bio.markers = {}
     for m in hf.attrs.get("markers", []):
-        bio.markers[m] = hf.attrs[m][:]  # get the markers in question, make a copy
+        bio.add_marker(
+            m,
+            hf.attrs[m],
+            labels=hf.attrs.get(m + LABELS_SUFFIX, None),
+            durations=hf.attrs.get(m + DURATIONS_SUFFIX, None),
+        )
 
     if (
         "meta" in hf
@@ -66,4 +154,7 @@ def load(fname):
             # print("Add {}".format(k))
             bio.add_meta(k, m.attrs[k])
 
+    if not lazy:
+        hf.close()
+
     return bio
@@ -5,19 +5,33 @@ import datetime
 
 
 import pyxdf  # pip3 install pyxdf
-from scipy.interpolate import interp1d
 
 
 
 
-def load(fname):
-    """Load LSL format XDF file."""
+def load(fname, streams=None, channels=None):
+    """
+    Load LSL format XDF file.
+
+    fname : filename of the file to be read
+    streams : which streams to load, or None to load all of them.
+              Can be a stream name, a stream ID (int), a dict of stream properties
+              to match (e.g. {"type": "ECG"}), or a list of these.
+              Streams that are not selected are not decoded at all, which saves time and memory.
+              Note that time zero is then the onset of the earliest selected stream.
+    channels : a channel ID or list of channel IDs to keep, or None to keep all.
+              Channels that are not kept are not resampled.
+    """
 
     bio = biobabel.Biodata()  # create a new biodata object
     bio.name = fname
 
+    if isinstance(channels, str):
+        channels = [channels]
+
     # This file is included in bioread
     streams, header = pyxdf.load_xdf(fname,
+                                     select_streams=stream_queries(fname, streams),
                                      dejitter_timestamps=True, # should be default, but just to be sure
                                      synchronize_clocks=True
                                      )
@@ -42,35 +56,42 @@ def load(fname):
         if dtype=='string':
             continue # work with strings later # TODO
 
-        modality = biobabel.guess_modality(stream_type)
-        
-        # Find out which time stamps are within the time range
-        rawdata = s["time_series"].T[0]
-        # just take the first stream # TODO: This could be expanded to extract multiple streams
         timestamps = s['time_stamps']
+        if not len(timestamps):
+            continue # empty stream
 
         SR = info['effective_srate'] # take the effective sampling rate since the nominal can be off or even zero
-        
-        # Use interpolation to get a regular sampled grid determined by the effective sampling rate
+
+        # Work out the channel IDs first, so that we only resample the channels we need
+        chinfos = get_channel_info(info, s["time_series"].shape[1])
+        chids = []
+        for i, chinfo in enumerate(chinfos):
+            if len(chinfos) == 1:
+                chids.append(stream_name)
+            else:
+                chids.append("{}_{}".format(stream_name, chinfo.get("label", i + 1)))
+        cols = [i for i, chid in enumerate(chids) if channels is None or chid in channels]
+        if not cols:
+            continue
+
+        # Resample the channels onto a regular grid determined by the effective sampling rate
         target_t = np.arange(ONSET_T,np.max(timestamps),1/SR)
-        f = interp1d(timestamps, rawdata, kind='nearest', bounds_error = False, fill_value=np.nan)
-        signal_interp = f(target_t)
-        
+        signal_interp = resample_nearest(timestamps, s["time_series"][:, cols], target_t)
+
         #SR = float(info["nominal_srate"][0])  # info['effective_srate']
-        units = 'unknown'
-        desc = info.get('desc',[])
-        if desc and desc[0]:
-            units = desc[0]["channels"][0]["channel"][0]["unit"][0]
-
-        hdr = {
-            "id": stream_name,
-            "participant": stream_name,
-            "sampling_frequency": SR,
-            "modality": modality,
-            "units": units,
-        }
-        dat = signal_interp
-        bio.add_channel((hdr, np.array(dat)))
+        for j, i in enumerate(cols):
+            chinfo = chinfos[i]
+            modality = biobabel.guess_modality(chinfo.get("type", stream_type))
+            chid = chids[i]
+
+            hdr = {
+                "id": chid,
+                "participant": stream_name,
+                "sampling_frequency": SR,
+                "modality": modality,
+                "units": chinfo.get("unit", "unknown"),
+            }
+            bio.add_channel((hdr, signal_interp[:, j]))
 
     if 'datetime' in header['info']:
         bio.meta["date"] = stringify(header["info"]["datetime"])
@@ -83,6 +104,91 @@ def load(fname):
 
 
 
+def stream_queries(fname, streams):
+    """
+    Translate our way of selecting streams into what pyxdf expects for select_streams:
+    either a list of stream IDs or a list of dicts of stream properties.
+    """
+    if streams is None:
+        return None
+    if not isinstance(streams, list):
+        streams = [streams]
+    queries = [{"name": s} if isinstance(s, str) else s for s in streams]
+    if all(isinstance(q, dict) for q in queries) or all(isinstance(q, int) for q in queries):
+        return queries
+
+    # A mix of IDs and properties; look up the IDs of the streams that match the properties
+    infos = pyxdf.resolve_streams(fname)
+    ids = []
+    for q in queries:
+        if isinstance(q, int):
+            ids.append(q)
+        else:
+            ids += pyxdf.match_streaminfos(infos, [q])
+    return sorted(set(ids))
+
+
+def resample_nearest(timestamps, values, target_t):
+    """
+    Resample irregularly sampled data onto the given time points,
+    taking for each time point the value of the nearest sample.
+
+    timestamps : the time stamps of the samples (one-dimensional array)
+    values : the samples, a two-dimensional array (samples x channels)
+    target_t : the time points to resample to
+
+    Returns a two-dimensional array (time points x channels).
+    Time points outside the range of the samples are set to NaN.
+
+    The nearest sample is found once for all channels, so that this is cheap
+    also for streams with many channels.
+    """
+    timestamps = np.asarray(timestamps)
+    values = np.asarray(values)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    if np.any(np.diff(timestamps) < 0):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+
+    n = len(timestamps)
+    right = np.clip(np.searchsorted(timestamps, target_t), 1, max(1, n - 1))
+    left = right - 1
+    if n == 1:
+        nearest = np.zeros(len(target_t), dtype=int)
+    else:
+        # Take the left neighbour if it is at least as close (the same as interp1d's "nearest")
+        nearest = np.where(
+            target_t - timestamps[left] <= timestamps[right] - target_t, left, right
+        )
+    inrange = (target_t >= timestamps[0]) & (target_t <= timestamps[-1])
+
+    dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+    # Column-major, so that each channel is contiguous in memory
+    out = np.full((len(target_t), values.shape[1]), np.nan, dtype=dtype, order="F")
+    out[inrange] = values[nearest[inrange]]
+    return out
+
+
+def get_channel_info(info, nchannels):
+    """
+    Get the description (label, unit, type) of each channel in a stream, as far as available.
+    Returns a list with a dict for each channel.
+    """
+    channels = [{} for _ in range(nchannels)]
+    desc = info.get('desc',[])
+    if desc and desc[0]:
+        try:
+            descs = desc[0]["channels"][0]["channel"]
+        except (KeyError, IndexError, TypeError):
+            descs = []
+        for chinfo, d in zip(channels, descs):
+            for k, key in [("label", "label"), ("label", "name"), ("unit", "unit"), ("type", "type")]:
+                if k not in chinfo and d.get(key, None):
+                    chinfo[k] = stringify(d[key])
+    return channels
+
+
 def get_onset_offset(streams):
     """
     One issue is that in XDF, streams can start at different moments in time.
@@ -92,10 +198,10 @@ def get_onset_offset(streams):
     before that. 
     """
 
-    start_ts = [min(s["time_stamps"]) for s in streams]
+    start_ts = [np.min(s["time_stamps"]) for s in streams if len(s["time_stamps"])]
     ONSET_T = min(start_ts)
 
-    end_ts = [max(s["time_stamps"]) for s in streams]
+    end_ts = [np.max(s["time_stamps"]) for s in streams if len(s["time_stamps"])]
     OFFSET_T = max(end_ts)
     
     #n_samp = [sum(s["time_stamps"] >= ONSET_T) for s in streams]
@@ -3,6 +3,60 @@ import numpy as np
 import os
 import datetime
 import json
+import re
+import warnings
+
+
+# The data fields in each "raw" line, in order
+FIELDS = ["t", "fsr", "ecg", "therm", "ppg", "snd"]
+
+# Lines containing samples look like "<x> 0 raw t fsr ecg therm ppg snd".
+# The patterns start with a newline (rather than ^) because that allows
+# the regular expression engine to skip quickly to candidate positions.
+RAW_LINE = re.compile(rb"\n[^ \n]* 0 raw ([^\n]*)")
+STRICT_RAW_LINE = re.compile(
+    rb"\n[^ \n]* 0 raw (" + rb" ".join([rb"-?\d+"] * len(FIELDS)) + rb")\r?(?=\n|$)"
+)
+
+# Lines containing events look like "<x> # <y> type t"
+EVENT_LINE = re.compile(rb"\n[^ \n]* # [^ \n]* ([^ \n]*) (-?\d+)(?=[ \r\n]|$)")
+
+START_SIGNAL = b"# Start signal received"
+
+
+def parse_numbers(lines):
+    """Parse the integers in a list of lines (bytes) into a flat array, or return None if they contain anything else."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # numpy only warns when it hits non-numbers
+        try:
+            return np.fromstring(b" ".join(lines), dtype=np.int64, sep=" ")
+        except (ValueError, DeprecationWarning):
+            return None
+
+
+def parse(buf):
+    """
+    Parse a chunk of a TeensyECG log.
+
+    buf : bytes, consisting of complete lines
+
+    Returns a tuple (raw,events) where raw is an integer array with one row per sample
+    and one column for each of FIELDS, and events is a list of (type,t) tuples.
+
+    Rather than going through the lines one by one, we pick out the sample lines
+    with a regular expression and let numpy parse all their numbers in one go.
+    """
+    buf = b"\n" + buf
+    lines = RAW_LINE.findall(buf)
+    raw = parse_numbers(lines)
+    if raw is None or raw.shape[0] != len(lines) * len(FIELDS):
+        # Some lines are malformed (e.g. truncated), so only take the ones that have exactly the expected fields
+        lines = STRICT_RAW_LINE.findall(buf)
+        raw = parse_numbers(lines)
+    raw = raw.reshape(-1, len(FIELDS))
+
+    events = [(tp.decode(), int(t)) for (tp, t) in EVENT_LINE.findall(buf)]
+    return raw, events
 
 
 def load(fname):
@@ -14,67 +68,36 @@ def load(fname):
     dt_m = datetime.datetime.fromtimestamp(m_time)
     bio.add_meta("date", dt_m.strftime(biobabel.DATEFORMAT))
 
-    with open(fname, "r") as f:
-        firstline = f.readline()
+    with open(fname, "rb") as f:
+        firstline = f.readline().decode(errors="replace")
         # print(firstline)
         cont = f.read()
 
     # See if we can scrape more config data
-    cfg = firstline.find("CONFIG")
-    if cfg > -1:
-        c = firstline[(cfg + 6) :]
-        # print(c)
-        config = json.loads(c)
-        # print(config)
-        for k in config:
-            bio.add_meta(k, config[k])
+    read_config(firstline, bio)
 
     # Remove some initial nonsense data that typically enters these files
-    startp = cont.find("# Start signal received")
+    startp = cont.find(START_SIGNAL)
     if startp < 0:
         print("### ERROR, no starting point found!")
 
-    contents = cont[startp:].split("\n")
+    raw, events = parse(cont[startp:])
 
     # Assumed unless ohterwise specified
     TIME_DIVISOR = 1000
 
     # TODO: could retrieve the field names from the data header itself
 
-    alldata = []
-    events = []
-    for ln in contents:
-        if not ln:
-            continue
-        items = ln.split(" ")
-        if items[1] == "#":
-            ev = {"type": items[3], "t": int(items[4])}
-            events.append(ev)
-            continue
-        if items[1] == "0" and items[2] == "raw":
-            # Try to parse it
-            t, fsr, ecg, therm, ppg, snd = items[3:]
-            alldata.append(
-                {
-                    "t": int(t),
-                    "fsr": int(fsr),
-                    "ecg": int(ecg),
-                    "therm": int(therm),
-                    "ppg": int(ppg),
-                    "snd": int(snd),
-                }
-            )
-
-    t = [d["t"] for d in alldata]
-    t0 = min(t)
+    t = raw[:, 0]
+    t0 = np.min(t)
     dt = np.diff(t) / TIME_DIVISOR
 
-    mediandt = np.median(dt)
+    mediandt = median_step(count_steps(t)) / TIME_DIVISOR
 
     print("-- A human may want to inspect this:")
     print(
         "Time step values (in s) min={:.5f}, max={:.5f}, mean={:.5f}, median={:.5f}, SD={:.5f}".format(
-            np.min(dt), np.max(dt), np.mean(dt), np.median(dt), np.std(dt)
+            np.min(dt), np.max(dt), np.mean(dt), mediandt, np.std(dt)
         )
     )
     THRESH = mediandt * 1.1
@@ -84,7 +107,9 @@ def load(fname):
 
     SR = 1 / mediandt
 
-    for chan in ["fsr", "ecg", "therm", "ppg", "snd"]:
+    for i, chan in enumerate(FIELDS):
+        if chan == "t":
+            continue
         hdr = {
             "id": chan,
             "participant": "participant",
@@ -92,13 +117,211 @@ def load(fname):
             "modality": biobabel.guess_modality(chan),
             "units": "a.u",
         }
-        dat = [d[chan] for d in alldata]
-        bio.add_channel((hdr, np.array(dat)))
+        dat = compact(raw[:, i])
+        bio.add_channel((hdr, dat))
 
-    eventtypes = list(set([x["type"] for x in events]))
-    markers = {}
-    for e in eventtypes:
-        markers[e] = [(ev["t"] - t0) / TIME_DIVISOR for ev in events if ev["type"] == e]
-    bio.markers = markers
+    for e, ts in make_markers(events, t0, TIME_DIVISOR).items():
+        bio.add_marker(e, ts)
 
     return bio
+
+
+def compact(col):
+    """
+    Copy a column of parsed samples into a contiguous array of the smallest of int16, int32
+    or int64 that holds its values (the ADC values fit in 16 bits, so we need not keep 64).
+    """
+    if col.size:
+        lo, hi = col.min(), col.max()
+        for dtype in (np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= lo and hi <= info.max:
+                return col.astype(dtype)  # astype gives a contiguous copy
+    return np.ascontiguousarray(col)
+
+
+def make_markers(events, t0, time_divisor):
+    """Turn a list of (type,t) events into markers, expressed in seconds from t0."""
+    markers = {}
+    for tp, et in events:
+        markers.setdefault(tp, []).append((et - t0) / time_divisor)
+    return markers
+
+
+def count_steps(t, steps=None):
+    """
+    Count how often each time step occurs between consecutive time stamps.
+
+    :param t: integer array, the time stamps
+    :param steps: dict of step to count, to add to (e.g. from an earlier part of the file)
+    :returns: dict of step to count
+    """
+    if steps is None:
+        steps = {}
+    for step, count in zip(*np.unique(np.diff(t), return_counts=True)):
+        steps[step] = steps.get(step, 0) + count
+    return steps
+
+
+def median_step(steps):
+    """
+    The median time step, from the counts made by count_steps().
+
+    This is the same as np.median(np.diff(t)), but the counts can be kept up to date
+    as samples come in, so that a stream gives the same sampling rate as load().
+    """
+    keys = sorted(steps)
+    cum = np.cumsum([steps[k] for k in keys])
+    n = cum[-1]
+    lo = keys[np.searchsorted(cum, (n - 1) // 2, side="right")]
+    hi = keys[np.searchsorted(cum, n // 2, side="right")]
+    return (lo + hi) / 2
+
+
+def read_config(firstline, bio):
+    """See if we can scrape config data from the first line of the file, and add it to the metadata."""
+    cfg = firstline.find("CONFIG")
+    if cfg > -1:
+        c = firstline[(cfg + 6) :]
+        # print(c)
+        config = json.loads(c)
+        # print(config)
+        for k in config:
+            bio.add_meta(k, config[k])
+
+
+class TeensyECGStream:
+    """
+    Incremental reader for a TeensyECG log that is still being written.
+
+    Each call to poll() parses only the bytes that were appended since the
+    previous call, and extends the channels and markers of the Biodata
+    object in self.bio.
+
+    Example:
+
+    .. code-block:: python
+
+       stream = TeensyECGStream('recording.txt')
+       bio = stream.bio
+       while recording:
+           time.sleep(1)
+           if stream.poll():
+               bio.print()
+
+    """
+
+    # Initial number of samples we reserve room for; this doubles when it fills up
+    INITIAL_CAPACITY = 2**16
+
+    TIME_DIVISOR = 1000
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.offset = 0  # byte offset of the first unparsed line
+        self.started = False  # whether we have seen the start signal
+        self.n = 0  # number of samples read so far
+        # One row per field, so that the data of each channel is contiguous
+        self.raw = np.empty((len(FIELDS), self.INITIAL_CAPACITY), dtype=np.int64)
+        self.events = []
+        self.nmarked = 0  # number of events that have been added to the markers
+        self.t0 = None  # time stamp of the earliest sample
+        self.marker_t0 = None  # the t0 the markers are relative to
+        self.steps = {}  # time step counts, from which we get the sampling rate (see count_steps)
+        self.SR = None
+
+        self.bio = biobabel.Biodata()
+        self.bio.name = fname
+        self.bio.stream = self  # so that viewers know they can poll for more data
+
+        m_time = os.path.getmtime(fname)
+        dt_m = datetime.datetime.fromtimestamp(m_time)
+        self.bio.add_meta("date", dt_m.strftime(biobabel.DATEFORMAT))
+
+        self.poll()
+
+    def poll(self):
+        """
+        Read whatever has been appended to the file since the last call.
+
+        :returns: the number of new samples
+        :rtype: int
+        """
+        with open(self.fname, "rb") as f:
+            f.seek(self.offset)
+            buf = f.read()
+
+        # Only parse complete lines; the last one may still be being written
+        end = buf.rfind(b"\n")
+        if end < 0:
+            return 0
+        buf = buf[: end + 1]
+        if self.offset == 0:
+            firstline, _, buf = buf.partition(b"\n")
+            read_config(firstline.decode(errors="replace"), self.bio)
+        self.offset += end + 1
+
+        if not self.started:
+            startp = buf.find(START_SIGNAL)
+            if startp < 0:
+                return 0  # still in the initial nonsense data
+            self.started = True
+            buf = buf[startp:]
+
+        raw, events = parse(buf)
+        self.events += events
+        nnew = raw.shape[0]
+        if not nnew and not events:
+            return 0
+
+        # Make room, growing geometrically so that appending is cheap on average
+        if self.n + nnew > self.raw.shape[1]:
+            cap = self.raw.shape[1]
+            while cap < self.n + nnew:
+                cap *= 2
+            grown = np.empty((len(FIELDS), cap), dtype=np.int64)
+            grown[:, : self.n] = self.raw[:, : self.n]
+            self.raw = grown
+        self.raw[:, self.n : self.n + nnew] = raw.T
+        count_steps(self.raw[0, max(self.n - 1, 0) : self.n + nnew], self.steps)
+        self.n += nnew
+        if nnew:
+            t0 = np.min(raw[:, 0])
+            self.t0 = t0 if self.t0 is None else min(self.t0, t0)
+
+        self.update()
+        return nnew
+
+    def update(self):
+        """Bring the Biodata object up to date with the samples read so far."""
+        if self.n < 2:
+            return  # cannot determine a sampling rate yet
+
+        self.SR = 1 / (median_step(self.steps) / self.TIME_DIVISOR)
+
+        for i, chan in enumerate(FIELDS):
+            if chan == "t":
+                continue
+            dat = self.raw[i, : self.n]
+            if not self.bio.find_channels({"id": chan}):
+                hdr = {
+                    "id": chan,
+                    "participant": "participant",
+                    "sampling_frequency": self.SR,
+                    "modality": biobabel.guess_modality(chan),
+                    "units": "a.u",
+                }
+                self.bio.add_channel((hdr, dat))
+            else:
+                self.bio.update_channel(chan, {"sampling_frequency": self.SR})
+                self.bio.update_data(chan, dat)
+
+        if self.t0 != self.marker_t0:
+            # Markers are relative to the earliest sample, so if that changed they need redoing
+            self.bio.clear_markers()
+            self.nmarked = 0
+            self.marker_t0 = self.t0
+        new = self.events[self.nmarked :]
+        for e, ts in make_markers(new, self.t0, self.TIME_DIVISOR).items():
+            self.bio.extend_marker(e, ts)
+        self.nmarked = len(self.events)
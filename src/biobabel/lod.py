@@ -0,0 +1,207 @@
+# Level-of-detail pyramids for fast plotting of long recordings.
+#
+#   For each channel, we keep the minimum and maximum of bins of 8, 64, 512, ... samples.
+#   To plot a time window, we then pick the finest level that has few enough bins in that window,
+#   so that drawing a window takes about the same time whether it spans a second or a whole day.
+#
+#   As in envelope(), NaN values (gaps) are ignored when taking the minimum and maximum.
+#
+#   Pyramids are built once (in blocks, so that lazily loaded data never needs to be in memory at once)
+#   and can be saved next to the recording, so that they need not be rebuilt the next time.
+
+import os
+import numpy as np
+
+from biobabel.biodata import envelope
+
+# Each level has bins that are this many times larger than the previous one
+LOD_FACTOR = 8
+
+# Stop adding levels once a level has no more than this many bins
+MIN_LEVEL_SIZE = 512
+
+# Number of samples read at once when building (a multiple of LOD_FACTOR)
+BUILD_BLOCK_SIZE = 2**20
+
+# Bumped whenever the format of saved pyramids changes
+LOD_FORMAT_VERSION = 1
+
+
+class Pyramid:
+    """
+    The min/max pyramid of a single channel.
+
+    levels[k] is a tuple (mins,maxs) for bins of factor**(k+1) samples.
+    """
+
+    def __init__(self, n, factor=LOD_FACTOR, levels=None):
+        self.n = n
+        self.factor = factor
+        self.levels = levels if levels is not None else []
+
+    @classmethod
+    def build(cls, vals, factor=LOD_FACTOR):
+        """
+        Compute the pyramid of a signal.
+
+        :param vals: one-dimensional array (or lazily loaded channel), the signal
+        :param factor: int, the ratio of bin sizes between subsequent levels
+        """
+        n = vals.shape[0]
+        pyr = cls(n, factor)
+        if n <= MIN_LEVEL_SIZE:
+            return pyr
+
+        # The first level is computed from the data itself, block by block
+        block = BUILD_BLOCK_SIZE - BUILD_BLOCK_SIZE % factor
+        mins, maxs = [], []
+        for i in range(0, n, block):
+            blk = np.asarray(vals[i : i + block])
+            starts = np.arange(0, blk.shape[0], factor)
+            mins.append(np.fmin.reduceat(blk, starts))
+            maxs.append(np.fmax.reduceat(blk, starts))
+        level = (np.concatenate(mins), np.concatenate(maxs))
+        pyr.levels.append(level)
+
+        # Further levels from the previous level
+        while level[0].shape[0] > MIN_LEVEL_SIZE:
+            starts = np.arange(0, level[0].shape[0], factor)
+            level = (
+                np.fmin.reduceat(level[0], starts),
+                np.fmax.reduceat(level[1], starts),
+            )
+            pyr.levels.append(level)
+        return pyr
+
+    def window(self, vals, fromi, toi, npoints):
+        """
+        Get the points to plot for samples fromi..toi-1.
+
+        :param vals: the signal that this pyramid was built from (only read when zoomed in far enough)
+        :param fromi: int, the first sample
+        :param toi: int, one beyond the last sample
+        :param npoints: int, the (approximate) maximum number of points to return
+        :returns: (idx,env), the (fractional) sample positions and the values to be plotted, as envelope()
+        :rtype: (numpy.array,numpy.array)
+        """
+        fromi, toi = max(0, fromi), min(self.n, toi)
+        nbins = max(1, npoints // 2)
+        span = toi - fromi
+
+        # Find the finest level from which we need to read no more than factor*nbins values
+        binsize, level = 1, None
+        for mins, maxs in self.levels:
+            if span <= binsize * self.factor * nbins:
+                break
+            binsize *= self.factor
+            level = (mins, maxs)
+
+        if level is None:
+            # Zoomed in: read from the data itself
+            idx, env = envelope(np.asarray(vals[fromi:toi]), npoints)
+            return fromi + idx, env
+
+        mins, maxs = level
+        a, b = fromi // binsize, -(-toi // binsize)
+        mn, mx = mins[a:b], maxs[a:b]
+        step = binsize
+        if mn.shape[0] > nbins:
+            # Combine bins further, so that we return no more than nbins of them
+            k = int(np.ceil(mn.shape[0] / nbins))
+            starts = np.arange(0, mn.shape[0], k)
+            mn, mx = np.fmin.reduceat(mn, starts), np.fmax.reduceat(mx, starts)
+            step = k * binsize
+        starts = a * binsize + np.arange(mn.shape[0]) * step
+        idx = np.empty(2 * mn.shape[0])
+        idx[0::2] = starts
+        idx[1::2] = np.minimum(starts + step / 2, self.n - 1)
+        env = np.empty(2 * mn.shape[0], dtype=mn.dtype)
+        env[0::2] = mn
+        env[1::2] = mx
+        return idx, env
+
+
+def sidecar_name(fname):
+    """Return the file in which the pyramids for a given recording are saved."""
+    return os.path.splitext(fname)[0] + ".lod.npz"
+
+
+def save(pyramids, fname):
+    """
+    Save the pyramids of a recording next to it.
+
+    :param pyramids: dict of channel ID to Pyramid
+    :param fname: str, the recording that the pyramids were built from
+    """
+    st = os.stat(fname)
+    arrays = {
+        "version": LOD_FORMAT_VERSION,
+        "source": [st.st_size, st.st_mtime_ns],
+        "channels": np.array(list(pyramids.keys()), dtype=str),
+    }
+    for i, (chid, pyr) in enumerate(pyramids.items()):
+        arrays["n_{}".format(i)] = [pyr.n, pyr.factor, len(pyr.levels)]
+        for k, (mins, maxs) in enumerate(pyr.levels):
+            arrays["min_{}_{}".format(i, k)] = mins
+            arrays["max_{}_{}".format(i, k)] = maxs
+    outf = sidecar_name(fname)
+    tmp = outf + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, outf)
+
+
+def load(fname):
+    """
+    Load the saved pyramids of a recording.
+
+    :param fname: str, the recording
+    :returns: dict of channel ID to Pyramid, or None if there are none or they are out of date
+    """
+    lodf = sidecar_name(fname)
+    if not os.path.exists(lodf):
+        return None
+    st = os.stat(fname)
+    try:
+        with np.load(lodf) as f:
+            if int(f["version"]) != LOD_FORMAT_VERSION or list(f["source"]) != [
+                st.st_size,
+                st.st_mtime_ns,
+            ]:
+                return None  # the recording has changed since
+            pyramids = {}
+            for i, chid in enumerate(f["channels"]):
+                n, factor, nlevels = f["n_{}".format(i)]
+                levels = [
+                    (f["min_{}_{}".format(i, k)], f["max_{}_{}".format(i, k)])
+                    for k in range(nlevels)
+                ]
+                pyramids[str(chid)] = Pyramid(int(n), int(factor), levels)
+            return pyramids
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def get_pyramids(bio, chans, fname=None):
+    """
+    Get the pyramids for the given channels, building them if needed.
+
+    :param bio: the Biodata object
+    :param chans: list of str, the channel IDs
+    :param fname: str, if given, the recording that bio was loaded from; pyramids are then read from (or saved to) a file next to it
+    :returns: dict of channel ID to Pyramid
+    """
+    pyramids = None
+    if fname:
+        pyramids = load(fname)
+    if pyramids is not None and all(
+        c in pyramids and pyramids[c].n == bio.get(c)[1].shape[0] for c in chans
+    ):
+        return pyramids
+
+    pyramids = {c: Pyramid.build(bio.get(c)[1]) for c in bio.find_channels()}
+    if fname:
+        try:
+            save(pyramids, fname)
+        except OSError as e:
+            print("Could not save level-of-detail data next to {}: {}".format(fname, e))
+    return pyramids
@@ -0,0 +1,393 @@
+# Output data to our own flavour of HDF5-dataset (hdphysio5)
+
+import h5py
+import numpy as np
+import os
+import time
+
+from biobabel.biodata import sample_range
+
+
+# Marker labels and durations are stored in attributes named after the marker, with these suffixes
+LABELS_SUFFIX = ".labels"
+DURATIONS_SUFFIX = ".durations"
+
+# Number of samples per HDF5 chunk for channels that are appended to
+DEFAULT_CHUNK_SIZE = 2**16
+
+# Number of samples that we write in one go when writing a whole channel,
+# so that we never need to hold more than this in memory (e.g. when casting).
+WRITE_BLOCK_SIZE = 2**20
+
+
+def storage_dtype(dtype, requested=None):
+    """
+    Decide in which data type a channel will be stored.
+
+    dtype : the data type of the channel in memory
+    requested : the data type asked for by the user, None to decide automatically, or "preserve" to keep the data type as it is.
+
+    By default, integer data (e.g. ADC values) and single precision floats are stored as they are,
+    and everything else is stored as single precision float.
+    """
+    if isinstance(requested, str) and requested == "preserve":
+        return np.dtype(dtype)
+    if requested is not None:
+        return np.dtype(requested)
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer) or dtype == np.float32:
+        return dtype
+    return np.dtype("f")
+
+
+class Writer:
+    """
+    Write a hdphysio5 file, channel by channel, optionally block by block.
+
+    Example:
+
+    .. code-block:: python
+
+       with Writer('out.hdf5', compression='gzip', shuffle=True) as w:
+           w.add_channel(hdr, dat)  # write a channel in one go
+           w.create_channel(hdr2, dtype='int16')
+           for block in blocks:
+               w.append(hdr2['id'], block)  # write a channel piece by piece
+           w.write_markers(markers)
+    """
+
+    def __init__(
+        self,
+        fname,
+        compression=None,
+        compression_opts=None,
+        shuffle=False,
+        chunks=None,
+        dtype=None,
+    ):
+        """
+        :param fname: str, the file to be created (will be overwritten if it exists)
+        :param compression: None, 'gzip' or 'lzf', the HDF5 compression filter to apply to the channels
+        :param compression_opts: the compression level (for gzip, 0-9)
+        :param shuffle: bool, whether to apply the shuffle filter (typically improves compression)
+        :param chunks: int, the number of samples per chunk, or None to store channels contiguously where possible
+        :param dtype: the data type to store channels in, None to preserve integer data types, or "preserve" to preserve all data types
+        """
+        self.fname = fname
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+        self.chunks = chunks
+        self.dtype = dtype
+
+        self.hf = h5py.File(fname, "w")
+        self.participants = []
+        self.datasets = {}  # channel id to dataset
+        self.filled = {}  # channel id to the number of samples appended so far
+        self.date = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def set_name(self, name):
+        self.hf.attrs["name"] = name
+
+    def set_date(self, date):
+        self.date = date
+
+    def write_meta(self, meta):
+        """Write metadata (dict) as attributes of an empty 'meta' dataset."""
+        if "meta" in self.hf:
+            m = self.hf["meta"]
+        else:
+            m = self.hf.create_dataset("meta", data=h5py.Empty("f"))
+        for k in meta:
+            m.attrs[k] = meta[k]
+
+    def write_markers(self, markers, labels={}, durations={}):
+        """
+        Write markers.
+
+        :param markers: dict of marker name to list of time points
+        :param labels: dict of marker name to list of labels, for the markers that have them
+        :param durations: dict of marker name to list of durations, for the markers that have them
+        """
+        eventtypes = sorted(markers.keys())
+        if eventtypes:
+            self.hf.attrs["markers"] = eventtypes
+            for e in eventtypes:
+                self.hf.attrs[e] = markers[e]
+                if e in labels:
+                    self.hf.attrs[e + LABELS_SUFFIX] = [str(l) for l in labels[e]]
+                if e in durations:
+                    self.hf.attrs[e + DURATIONS_SUFFIX] = durations[e]
+
+    def _filters(self):
+        filt = {}
+        if self.compression:
+            filt["compression"] = self.compression
+            if self.compression_opts is not None:
+                filt["compression_opts"] = self.compression_opts
+        if self.shuffle:
+            filt["shuffle"] = True
+        return filt
+
+    def _create(self, hdr, dtype, size=None):
+        p = hdr["participant"]
+        if p not in self.participants:
+            self.participants.append(p)
+            self.hf.create_group(p, track_order=True)  # so that channels are read back in order
+
+        filt = self._filters()
+        chid = hdr["id"]
+        if size is not None and not self.chunks and not filt:
+            # Contiguous storage, which allows memory-mapping when reading back
+            dset = self.hf[p].create_dataset(chid, (size,), dtype=dtype)
+        else:
+            # Chunked storage, which is required for compression and appending
+            chunks = self.chunks if self.chunks else DEFAULT_CHUNK_SIZE
+            if size:
+                chunks = min(chunks, size)
+            dset = self.hf[p].create_dataset(
+                chid,
+                (size if size is not None else 0,),
+                maxshape=(None,),
+                dtype=dtype,
+                chunks=(chunks,),
+                **filt
+            )
+        dset.attrs["SR"] = hdr["sampling_frequency"]
+        dset.attrs["participant"] = p
+        dset.attrs["modality"] = hdr["modality"]
+        dset.attrs["units"] = hdr.get("units", "arbitrary")
+        self.datasets[chid] = dset
+        self.filled[chid] = 0
+        return dset
+
+    def add_channel(self, hdrdat):
+        """
+        Write a complete channel.
+
+        :param hdrdat: a tuple (hdr,dat) as stored in Biodata.
+
+        The data is written in blocks, so dat can be a lazily loaded array.
+        """
+        hdr, dat = hdrdat
+        dtype = storage_dtype(dat.dtype, self.dtype)
+        sz = dat.shape[0]
+        dset = self._create(hdr, dtype, size=sz)
+        for i in range(0, sz, WRITE_BLOCK_SIZE):
+            j = min(sz, i + WRITE_BLOCK_SIZE)
+            dset[i:j] = np.asarray(dat[i:j], dtype=dtype)
+        return dset
+
+    def create_channel(self, hdr, dtype="f", size=None):
+        """
+        Create an empty channel that data can then be appended to using append().
+
+        :param hdr: dict, the channel header (as in Biodata)
+        :param dtype: the data type of the channel; if this writer was created with an explicit dtype, that one is used instead.
+        :param size: int, the final number of samples, if known. This allows the channel to be stored contiguously.
+        """
+        return self._create(hdr, storage_dtype(dtype, self.dtype), size=size)
+
+    def append(self, chid, block):
+        """
+        Add data to the end of a channel created with create_channel().
+
+        :param chid: str, the channel ID
+        :param block: one-dimensional array of samples to be added
+        """
+        dset = self.datasets[chid]
+        block = np.asarray(block, dtype=dset.dtype)
+        n = self.filled[chid]
+        m = n + block.shape[0]
+        if m > dset.shape[0]:
+            dset.resize((m,))
+        dset[n:m] = block
+        self.filled[chid] = m
+
+    def close(self):
+        if not self.hf:
+            return
+        self.hf.attrs["participants"] = self.participants
+        if self.date:
+            self.hf.attrs["date"] = self.date
+        else:
+            self.hf.attrs["date"] = time.strftime("%m/%d/%Y %H:%M:%S %Z%z")
+        self.hf.close()
+        self.hf = None
+
+
+def write_segments(bio, segments, **options):
+    """
+    Write time segments of a Biodata object to separate hdphysio5 files, reading its data only once.
+
+    :param bio: the Biodata object, typically loaded with lazy=True so that its data is read block by block
+    :param segments: list of (fname,tfrom,tend) tuples, the files to be created and the time range (as in Biodata.crop()) that goes into each
+    :param options: further arguments for Writer (compression etc.)
+
+    Each channel is read in blocks of WRITE_BLOCK_SIZE samples, and each block is
+    passed on to the segments that it overlaps with. This gives the same files as
+    copying, cropping and saving the data for each segment, but only one block needs to be in memory.
+
+    The segments are written one after the other: h5py serialises all calls behind a global lock,
+    so writing from several threads would not be any faster.
+    """
+    writers = []
+    try:
+        for fname, tfrom, tend in segments:
+            w = Writer(fname, **options)
+            writers.append(w)
+            if bio.name:
+                w.set_name(bio.name)
+            if bio.date:
+                w.set_date(bio.date)
+            meta = bio.meta.copy()
+            meta["filename"] = fname
+            w.write_meta(meta)
+
+            # Keep the markers within the segment, as Biodata.crop() does
+            shift = tfrom if tfrom is not None and np.isfinite(tfrom) else 0
+            markers, labels, durations = {}, {}, {}
+            for m in bio.get_markers():
+                i, j = bio.marker_range(m, tfrom, tend)
+                markers[m] = bio.get_marker(m)[i:j] - shift
+                if bio.get_marker_labels(m) is not None:
+                    labels[m] = bio.get_marker_labels(m)[i:j]
+                if bio.get_marker_durations(m) is not None:
+                    durations[m] = bio.get_marker_durations(m)[i:j]
+            w.write_markers(markers, labels, durations)
+
+        for p in bio.get_participants():
+            for chid in bio.find_channels({"participant": p}):
+                hdr, dat = bio.get(chid)
+                n = dat.shape[0]
+                ranges = [
+                    sample_range(hdr["sampling_frequency"], n, tfrom, tend)
+                    for (_, tfrom, tend) in segments
+                ]
+                for w, (start, stop) in zip(writers, ranges):
+                    w.create_channel(hdr, dtype=dat.dtype, size=stop - start)
+
+                for i in range(0, n, WRITE_BLOCK_SIZE):
+                    j = min(n, i + WRITE_BLOCK_SIZE)
+                    block = np.asarray(dat[i:j])
+                    for w, (start, stop) in zip(writers, ranges):
+                        a, b = max(start, i), min(stop, j)
+                        if a < b:
+                            w.append(chid, block[a - i : b - i])
+    finally:
+        for w in writers:
+            w.close()
+
+
+def merge_files(fnames, outf, concat=False, workers=1, **options):
+    """
+    Merge several files into one hdphysio5 file, without holding all of them in memory.
+
+    :param fnames: list of str, the files to be merged
+    :param outf: str, the hdphysio5 file to be created
+    :param concat: bool, if False, the channels of all files are put side by side (as Biodata.merge() does),
+                   and markers with the same name are combined.
+                   If True, channels with the same ID are concatenated in time, in the order of the files,
+                   and the markers of each file are shifted by the duration of the files before it.
+    :param workers: int, the number of files to load at the same time
+    :param options: further arguments for Writer (compression etc.)
+    :returns: the (empty) Biodata object holding the merged channel headers, meta data and markers
+    :raises ValueError: if a file could not be loaded or does not fit with the others; no output file is written then
+
+    Each file is loaded (lazily where the format allows), written to the output, and released before
+    the next one is loaded, so that only `workers` input files are ever held in memory at the same time.
+    """
+    import biobabel.io
+    from biobabel.biodata import Biodata
+
+    # Keeps track of what has been written so far (with empty data)
+    merged = Biodata()
+    offset = 0  # in concat mode, the time at which the current file starts
+
+    # Write to a temporary file first, so that a failed merge does not leave a partial output file behind
+    tmp = outf + ".tmp"
+    try:
+        with Writer(tmp, **options) as w:
+            for b in range(0, len(fnames), max(1, workers)):
+                batch = fnames[b : b + max(1, workers)]
+                bios = biobabel.io.load_many(batch, workers=workers, lazy=True)
+                for inf, bio in zip(batch, bios):
+                    if isinstance(bio, Exception):
+                        raise ValueError("Could not load {}: {}".format(inf, bio))
+                    if not bio:
+                        raise ValueError("Could not load {}".format(inf))
+                    offset = merge_into(w, merged, bio, inf, concat, offset)
+                del bios, bio  # release these files before loading the next ones
+
+            w.write_meta(merged.meta)
+            w.write_markers(
+                merged.markers, merged.marker_labels, merged.marker_durations
+            )
+        os.replace(tmp, outf)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return merged
+
+
+def merge_into(w, merged, bio, inf, concat, offset):
+    """
+    Write the channels of one file to the output of merge_files(), and
+    add its metadata and markers to merged. Returns the time offset for the next file.
+    """
+    for k in bio.meta:
+        merged.add_meta(k, bio.meta[k], replace=False)
+
+    if concat and merged.channels:
+        ids = set(bio.find_channels())
+        known = set(merged.find_channels())
+        for chid in sorted(ids ^ known):
+            print(
+                "Warning: channel {} is not present in all files, so it will not be aligned in time.".format(
+                    chid
+                )
+            )
+
+    for hdr, dat in bio.channels:
+        hdr = hdr.copy()
+        if concat and hdr["id"] in w.datasets:
+            prev, _ = merged.get(hdr["id"])
+            if prev["sampling_frequency"] != hdr["sampling_frequency"]:
+                raise ValueError(
+                    "Channel {} in {} has a different sampling frequency than before.".format(
+                        hdr["id"], inf
+                    )
+                )
+        else:
+            merged.add_channel((hdr, np.empty(0, dtype=dat.dtype)))
+            if not concat:
+                # The ID may have been changed to keep it unique
+                w.add_channel((hdr, dat))
+                continue
+            w.create_channel(hdr, dtype=dat.dtype)
+        for i in range(0, dat.shape[0], WRITE_BLOCK_SIZE):
+            w.append(hdr["id"], dat[i : i + WRITE_BLOCK_SIZE])
+
+    for m in bio.get_markers():
+        t = bio.get_marker(m)
+        labels, durations = bio.get_marker_labels(m), bio.get_marker_durations(m)
+        if concat:
+            t = t + offset
+        else:
+            # The files are synchronous, so events that another file already has are not repeated
+            new = ~np.isin(t, merged.get_marker(m))
+            t = t[new]
+            labels = labels[new] if labels is not None else None
+            durations = durations[new] if durations is not None else None
+        merged.extend_marker(m, t, labels, durations)
+
+    if concat and bio.channels:
+        offset += bio.get_duration()
+    return offset
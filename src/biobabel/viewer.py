@@ -13,15 +13,20 @@ from matplotlib.backend_bases import key_press_handler
 from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 from matplotlib.backend_bases import MouseButton
+from matplotlib.collections import LineCollection
 
 import numpy as np
-import pandas as pd
 import os
-import scipy.signal
+
+from biobabel.biodata import envelope
 
 import json
 
+import queue
 import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Globals we carry around
@@ -54,7 +59,25 @@ def update_cursor():
     #    if x:
     #        gb['cursor.snap'].set_data([x], [get_signal_at_t(x)])
 
-    gb["canvas"].draw()
+    blit_cursor()
+
+
+def blit_cursor():
+    # Only redraw the cursor on top of the saved figure, rather than the whole figure
+    canvas = gb["canvas"]
+    if gb.get("background") is None:
+        return
+    canvas.restore_region(gb["background"])
+    for i, c in enumerate(gb["cursor"]):
+        gb["axs"][i][0].draw_artist(c)
+    canvas.blit(gb["fig"].bbox)
+
+
+def on_draw(event):
+    # After a full redraw, save the figure (without the cursor) so that we can blit the cursor on it
+    gb["background"] = gb["canvas"].copy_from_bbox(gb["fig"].bbox)
+    for i, c in enumerate(gb["cursor"]):
+        gb["axs"][i][0].draw_artist(c)
 
 
 def on_move(event):
@@ -132,6 +155,28 @@ def load_file(bio):
     load_channels(chans)
     gb["COLORS"] = dict(zip(chans, get_colors(len(chans))))
 
+    # Build the level-of-detail data in the background; until it is ready, we plot from the data itself
+    gb["lod"] = {}
+    if not getattr(bio, "stream", None):  # data that is still growing would make it outdated
+        import threading
+
+        threading.Thread(target=build_lod, daemon=True).start()
+
+
+# Whether to save level-of-detail data (.lod.npz) next to hdphysio5 files, so that it need not be rebuilt next time.
+# Off by default, since it writes files next to the user's data.
+PERSIST_LOD = False
+
+
+def build_lod():
+    import biobabel.lod
+
+    bio = gb["bio"]
+    fname = bio.meta.get("filename", None)
+    if not (PERSIST_LOD and fname and fname.lower().endswith(".hdf5")):
+        fname = None
+    gb["lod"] = biobabel.lod.get_pyramids(bio, bio.find_channels(), fname)
+
 
 def load_channels(chans):
     # Load data from the given channels
@@ -141,14 +186,17 @@ def load_channels(chans):
     gb["n.signals"] = len(chans)
 
     gb["data"] = {}
+    clear_window_cache()
     gb["tmin"] = np.inf
     gb["tmax"] = -np.inf
     for c in chans:
         hdr, vals = bio.get(c)
-        t = bio.get_time(c)
-        gb["tmin"] = min([gb["tmin"], min(t)])
-        gb["tmax"] = max([gb["tmax"], max(t)])
-        gb["data"][c] = {"hdr": hdr, "vals": vals, "t": t}
+        # Time is implicit: sample i is at i/SR, so we only need the number of samples
+        n = vals.shape[0]
+        if n:
+            gb["tmin"] = min([gb["tmin"], 0])
+            gb["tmax"] = max([gb["tmax"], (n - 1) / hdr["sampling_frequency"]])
+        gb["data"][c] = {"hdr": hdr, "vals": vals}
     # print("Current channels")
     # print(gb['channels'])
 
@@ -156,7 +204,6 @@ def load_channels(chans):
 def show_channels(chans):
     load_channels(chans)
     make_plot()
-    redraw()
     for c in gb["view.active"].keys():
         # if c in gb['channels']:
         gb["view.active"][c].set(1 if c in gb["channels"] else 0)
@@ -174,7 +221,23 @@ def toggle_channel(ch):
     show_channels(chans)
 
 
+# How often (in ms) to check for new data when following a file that is being recorded
+FOLLOW_INTERVAL = 1000
+
+
+def follow_stream():
+    # Read any data that was appended to the file, and show it
+    stream = gb["bio"].stream
+    if stream.poll():
+        load_channels(gb["channels"])
+        update_window_definitions()
+        redraw()
+    gb["root"].after(FOLLOW_INTERVAL, follow_stream)
+
+
 def on_closing():
+    if "prefetcher" in gb:
+        gb["prefetcher"].shutdown(wait=False, cancel_futures=True)
     gb["root"].destroy()
     sys.exit(0)
 
@@ -297,13 +360,49 @@ def make_plot():
     canvas.mpl_connect("motion_notify_event", on_move)
 
     canvas.mpl_connect("scroll_event", process_scroll_events)
+    canvas.mpl_connect("draw_event", on_draw)
 
     canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=True)
 
+    # Create the artists once; redraw() only updates their data
+    gb["background"] = None
+    gb["lines"] = []
+    gb["cursor"] = []
+    gb["markerlines"] = []
     for i, chan in enumerate(gb["channels"]):
         ax = gb["axs"][i][0]
         ax.spines["top"].set_visible(False)
         ax.spines["right"].set_visible(False)
+        ax.set_ylabel(chan)
+
+        (line,) = ax.plot(
+            [], [], "-", label="cleaned", zorder=-10, color=gb["COLORS"][chan]
+        )
+        gb["lines"].append(line)
+
+        # The cursor is animated, so that it is left out of full redraws and blitted instead
+        gb["cursor"].append(
+            ax.axvline(
+                x=gb["cursor.t"],
+                lw=1,
+                color="blue",
+                alpha=0.9,
+                zorder=99999,
+                animated=True,
+            )
+        )
+
+        # All (visible) markers of this axis in a single collection, spanning the full height of the axis
+        mrk = LineCollection(
+            [],
+            colors="gray",
+            linestyles=(0, (2, 2)),
+            transform=ax.get_xaxis_transform(),
+        )
+        ax.add_collection(mrk, autolim=False)
+        gb["markerlines"].append(mrk)
+
+    ax.set_xlabel("t(s)")
 
     redraw()
 
@@ -313,8 +412,8 @@ ALPHA = 0.8
 
 DO_SUBSAMPLE = True
 TARGET_PLOT_POINTS = 2000
-# how many points to actually plot in the current window (approximately)
-# If the truly available data is more than this, we downsample just for display purposes
+# how many points to actually plot in the current window (at most)
+# If the truly available data is more than this, we reduce it to a min/max envelope just for display purposes
 
 
 def closest_sample(t):
@@ -322,53 +421,179 @@ def closest_sample(t):
     return
 
 
-def redraw():
+def window_key(chan, tmin, tmax):
+    # Identify the data to plot for a channel in a given time window
+    bio = gb["bio"]
+    fromi, toi = bio.get_closest_sample(chan, tmin), bio.get_closest_sample(chan, tmax)
+    return (chan, fromi, toi, chan in gb["lod"])
+
+
+def compute_window(key):
+    # Get the points to plot for a channel in a window (as identified by window_key)
+    chan, fromi, toi, _ = key
+    toplot = gb["data"][chan]
+    SR = toplot["hdr"]["sampling_frequency"]
+    if DO_SUBSAMPLE and chan in gb["lod"]:
+        # Read a bounded number of points from the level-of-detail pyramid
+        idx, y = gb["lod"][chan].window(toplot["vals"], fromi, toi, TARGET_PLOT_POINTS)
+    elif DO_SUBSAMPLE:
+        # Keep the minimum and maximum of each bucket of samples, so that peaks remain visible
+        idx, y = envelope(np.asarray(toplot["vals"][fromi:toi]), TARGET_PLOT_POINTS)
+        idx = fromi + idx
+    else:
+        y = np.asarray(toplot["vals"][fromi:toi])
+        idx = fromi + np.arange(len(y))
+    return idx / SR, y
+
+
+# Whether to compute the windows before and after the current one in the background,
+# so that paging through the signal does not have to wait for the data to be read
+PREFETCH = True
+
+# How many computed windows (per channel) we keep around
+PREFETCH_CACHE_SIZE = 16
+
+
+def clear_window_cache():
+    for fut in gb.get("window.cache", {}).values():
+        fut.cancel()
+    gb["window.cache"] = OrderedDict()  # window key to Future, least recently used first
+
+
+def remember_window(key, fut):
+    cache = gb["window.cache"]
+    cache[key] = fut
+    cache.move_to_end(key)
+    while len(cache) > PREFETCH_CACHE_SIZE * max(1, gb["n.signals"]):
+        _, old = cache.popitem(last=False)
+        old.cancel()
+
+
+def get_window(chan, tmin, tmax):
+    # Get the points to plot for a channel in a window, or None if they are still being computed.
+    # The data is never read on the Tk thread: if the window is not ready yet,
+    # we queue it and redraw once it is done.
+    key = window_key(chan, tmin, tmax)
+    fut = gb["window.cache"].get(key, None)
+    if fut is None or fut.cancelled():
+        fut = get_prefetcher().submit(compute_window, key)
+    remember_window(key, fut)
+    if not fut.done():
+        fut.add_done_callback(window_ready)
+        return None
+    try:
+        return fut.result()
+    except Exception as e:
+        # Something went wrong in the background; try again here, so that we see the error if it persists
+        print("### Warning, could not compute window in the background: {}".format(e))
+        del gb["window.cache"][key]
+        return compute_window(key)
 
-    # Determine drawrange
-    tmin, tmax = (gb["tstart"], gb["tstart"] + gb["WINDOW_T"])
 
-    gb["cursor"] = [None for _ in range(gb["n.signals"])]
+# How often (in ms) the Tk thread checks for windows that were computed in the background
+READY_POLL_INTERVAL = 50
 
-    for i, chan in enumerate(gb["channels"]):
-        ax = gb["axs"][i][0]
-        ax.cla()  # clear the axes
 
-        toplot = gb["data"][chan]
+def get_ready_queue():
+    if "windows.ready" not in gb:
+        gb["windows.ready"] = queue.Queue()
+    return gb["windows.ready"]
 
-        # prep = biodata.preprocessed[ecg_target]
-        fromi, toi = gb["bio"].get_closest_sample(chan, tmin), gb[
-            "bio"
-        ].get_closest_sample(chan, tmax)
 
-        # tsels = (t>=tmin) & (t<=tmax)
+def window_ready(fut):
+    # Called (in the worker thread) when a window that we are waiting for has been computed.
+    # Tk must only be used from its own thread, so we just leave a note for poll_ready_windows().
+    if not fut.cancelled():
+        get_ready_queue().put(fut)
 
-        gb["cursor"][i] = ax.axvline(
-            x=gb["cursor.t"], lw=1, color="blue", alpha=0.9, zorder=99999
-        )
 
-        # Plot the actual signal
+def poll_ready_windows():
+    # Runs on the Tk thread: redraw if windows we were waiting for have come in
+    ready = get_ready_queue()
+    waited = False
+    while True:
+        try:
+            ready.get_nowait()
+        except queue.Empty:
+            break
+        waited = True
+    if waited:
+        redraw()
+    gb["root"].after(READY_POLL_INTERVAL, poll_ready_windows)
 
-        factor = 1
-        if DO_SUBSAMPLE:
-            factor = int((toi - fromi) / TARGET_PLOT_POINTS)
-            # if factor>1:
-            #    x,y = scipy.signal.decimate(x,factor),scipy.signal.decimate(y,factor)
-        if factor < 1:
-            factor = 1
 
-        x = toplot["t"][fromi:toi:factor]
-        y = toplot["vals"][fromi:toi:factor]
-        nplot = len(x)  ## the number of samples we'd plot if we don't do sub-sampling
+def get_prefetcher():
+    if "prefetcher" not in gb:
+        gb["prefetcher"] = ThreadPoolExecutor(max_workers=1)
+    return gb["prefetcher"]
 
-        # print(tmin,tmax,fromi,toi,min(x),max(x))
 
-        pch = "-"
-        if nplot < 200:
-            pch = "o-"
+def drop_stale_prefetches(tmin, tmax):
+    # Windows that were prefetched around where we were before, and that are not needed now, can wait
+    needed = set(window_key(chan, tmin, tmax) for chan in gb["channels"])
+    for key, fut in gb["window.cache"].items():
+        if key not in needed:
+            fut.cancel()  # (only cancels those that have not started yet)
 
-        ax.plot(x, y, pch, label="cleaned", zorder=-10, color=gb["COLORS"][chan])
 
-        ax.set_ylabel(chan)
+def prefetch():
+    # Queue the computation of the windows that the user is likely to go to next
+    tstart, wint = gb["tstart"], gb["WINDOW_T"]
+    shifts = [gb["WINDOW_SHIFT_T"] * wint, 0.95 * wint]  # as in forward_in_time, jump_forward_in_time
+    starts = [tstart + d for d in shifts] + [tstart - d for d in shifts]
+    for chan in gb["channels"]:
+        for t in starts:
+            key = window_key(chan, t, t + wint)
+            if key[1] >= key[2]:
+                continue  # outside of the signal
+            fut = gb["window.cache"].get(key, None)
+            if fut is not None and not fut.cancelled():
+                continue  # already there (or on its way)
+            remember_window(key, get_prefetcher().submit(compute_window, key))
+
+
+def redraw():
+
+    t0 = time.perf_counter()
+
+    # Determine drawrange
+    tmin, tmax = (gb["tstart"], gb["tstart"] + gb["WINDOW_T"])
+
+    drop_stale_prefetches(tmin, tmax)
+    loading = False
+    for i, chan in enumerate(gb["channels"]):
+        ax = gb["axs"][i][0]
+
+        # Plot the actual signal (prefetched, if we're lucky)
+        win = get_window(chan, tmin, tmax)
+        if win is None:
+            # Still being read: keep showing what we had, we will be back when it's there
+            loading = True
+        else:
+            x, y = win
+            nplot = len(x)  ## the number of points we plot
+
+            # print(tmin,tmax,fromi,toi,min(x),max(x))
+
+            line = gb["lines"][i]
+            line.set_data(x, y)
+            line.set_marker("o" if nplot < 200 else "")
+
+        mrk = gb["markerlines"][i]
+        mrk.set_visible(bool(gb["showmarkers"].get()))
+        if mrk.get_visible():
+            # Only pass on the markers in the current window
+            bio = gb["bio"]
+            mt = np.concatenate(
+                [np.empty(0)] + [bio.get_marker(m, tmin, tmax) for m in bio.get_markers()]
+            )
+            segs = np.zeros((len(mt), 2, 2))
+            segs[:, :, 0] = mt[:, None]
+            segs[:, 1, 1] = 1
+            mrk.set_segments(segs)
+
+        if win is None:
+            continue
 
         # Now determine the ylim scale
         AUTOSCALE = False  # whether to use the matplotlib default scale
@@ -388,21 +613,21 @@ def redraw():
                 pad = 0.0001
             ax.set_ylim(mn - pad, mx + pad)
 
-        if gb["showmarkers"].get():
-
-            bio = gb["bio"]
-            for m in bio.get_markers():
-                evs = bio.get_marker(m)
-                for t in evs:
-                    ax.axvline(x=t, color="gray", dashes=(2, 2))
-
     ax.set_xlim(tmin, tmax)
-    ax.set_xlabel("t(s)")
     gb["canvas"].draw()
+    if PREFETCH:
+        prefetch()
     gb["slider"].set(int(tmin / gb["WINDOW_T"]))
     # plt.tight_layout()
     # update_axes()
 
+    # Show how long drawing took
+    gb["status"].configure(
+        text="Redraw: {:.0f} ms{}".format(
+            1000 * (time.perf_counter() - t0), " (reading data...)" if loading else ""
+        )
+    )
+
 
 def get_colors(N):
     import colorsys
@@ -450,6 +675,10 @@ def main(bio):
 
     # Build the interface
 
+    # Status bar
+    gb["status"] = tkinter.Label(root, text="", anchor=tkinter.W)
+    gb["status"].pack(side=tkinter.BOTTOM, fill=tkinter.X)
+
     navf = tkinter.Frame(root)
     tkinter.Grid.columnconfigure(navf, 0, weight=1)
     navf.pack(side=tkinter.BOTTOM)
@@ -540,6 +769,9 @@ def main(bio):
     root.bind("<Key>", process_key_events)
 
     make_plot()
-    redraw()
+    root.after(READY_POLL_INTERVAL, poll_ready_windows)
+
+    if getattr(bio, "stream", None):
+        root.after(FOLLOW_INTERVAL, follow_stream)
 
     tkinter.mainloop()
@@ -0,0 +1,53 @@
+# Benchmark reading generic CSV files, comparing the sniff-then-C-parser path
+# with the original approach of letting pandas guess the delimiter using its Python parser.
+#
+# Run from the repository root:
+#   python tests/benchmark_csv.py [nrows]
+
+import biobabel.load_genericcsv
+import numpy as np
+import pandas as pd
+import os
+import sys
+import tempfile
+import time
+
+
+def write_wide_csv(fname, nrows, ncols=8):
+    tab = pd.DataFrame(
+        np.random.randint(0, 1024, size=(nrows, ncols)),
+        columns=["ch{}".format(i) for i in range(ncols)],
+    )
+    tab.insert(0, "time", np.arange(nrows) * 2)
+    tab.to_csv(fname, sep=";", index=False)
+
+
+def python_engine(fname):
+    return pd.read_csv(fname, sep=None, engine="python")
+
+
+def sniffed(fname):
+    return biobabel.load_genericcsv.read_table(fname)
+
+
+def timeit(func, fname):
+    t0 = time.perf_counter()
+    res = func(fname)
+    return res, time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as d:
+        fname = os.path.join(d, "data.csv")
+        write_wide_csv(fname, nrows)
+        size = os.path.getsize(fname) / 1e6
+        print("File of {} rows, {:.1f} MB".format(nrows, size))
+
+        old, told = timeit(python_engine, fname)
+        new, tnew = timeit(sniffed, fname)
+        assert np.array_equal(old.to_numpy(), new.to_numpy())
+
+        print("python engine, sep=None : {:6.2f} s ({:6.1f} MB/s)".format(told, size / told))
+        print("sniffed prefix, C engine: {:6.2f} s ({:6.1f} MB/s)".format(tnew, size / tnew))
+        print("speedup                 : {:6.1f}x".format(told / tnew))
@@ -0,0 +1,81 @@
+# Benchmark reading TeensyECG files, comparing the vectorized parser
+# with the original line-by-line implementation.
+#
+# Run from the repository root:
+#   python tests/benchmark_teensyecg.py [nsamples]
+
+import biobabel.load_teensyecg
+import numpy as np
+import os
+import sys
+import tempfile
+import time
+
+from test_teensyecg import write_teensy_log
+
+
+def legacy_parse(fname):
+    """The original parser, which builds one dict per sample."""
+    with open(fname, "r") as f:
+        f.readline()
+        cont = f.read()
+    startp = cont.find("# Start signal received")
+    contents = cont[startp:].split("\n")
+    alldata = []
+    events = []
+    for ln in contents:
+        if not ln:
+            continue
+        items = ln.split(" ")
+        if items[1] == "#":
+            events.append({"type": items[3], "t": int(items[4])})
+            continue
+        if items[1] == "0" and items[2] == "raw":
+            t, fsr, ecg, therm, ppg, snd = items[3:]
+            alldata.append(
+                {
+                    "t": int(t),
+                    "fsr": int(fsr),
+                    "ecg": int(ecg),
+                    "therm": int(therm),
+                    "ppg": int(ppg),
+                    "snd": int(snd),
+                }
+            )
+    return {c: np.array([d[c] for d in alldata]) for c in biobabel.load_teensyecg.FIELDS}
+
+
+def vectorized_parse(fname):
+    with open(fname, "rb") as f:
+        f.readline()
+        cont = f.read()
+    startp = cont.find(biobabel.load_teensyecg.START_SIGNAL)
+    raw, _ = biobabel.load_teensyecg.parse(cont[startp:])
+    return {c: raw[:, i] for i, c in enumerate(biobabel.load_teensyecg.FIELDS)}
+
+
+def throughput(func, fname, repeat=3):
+    size = os.path.getsize(fname) / 1e6
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = func(fname)
+        best = min(best, time.perf_counter() - t0)
+    return res, size / best
+
+
+if __name__ == "__main__":
+    nsamp = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as d:
+        fname = os.path.join(d, "teensy.txt")
+        write_teensy_log(fname, nsamp)
+        print("File of {} samples, {:.1f} MB".format(nsamp, os.path.getsize(fname) / 1e6))
+
+        old, old_mbs = throughput(legacy_parse, fname)
+        new, new_mbs = throughput(vectorized_parse, fname)
+        for c in old:
+            assert np.array_equal(old[c], new[c])
+
+        print("line-by-line parser : {:8.1f} MB/s".format(old_mbs))
+        print("vectorized parser   : {:8.1f} MB/s".format(new_mbs))
+        print("speedup             : {:8.1f}x".format(new_mbs / old_mbs))
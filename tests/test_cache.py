@@ -0,0 +1,74 @@
+# Test the on-disk cache of parsed files.
+
+import biobabel as bb
+import biobabel.cache
+import numpy as np
+import os
+import pytest
+import time
+
+from test_genericcsv import write_csv
+
+
+def test_cache_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setenv("BIOBABEL_CACHE_DIR", os.path.join(tmp_path, "cache"))
+    fname = os.path.join(tmp_path, "data.csv")
+    write_csv(fname)
+
+    bio = bb.load(fname, cache=True)
+    assert len(biobabel.cache.entries()) == 1
+
+    cached = bb.load(fname, cache=True)
+    assert cached.find_channels() == bio.find_channels()
+    for ch in bio.find_channels():
+        hdr, dat = bio.get(ch)
+        chdr, cdat = cached.get(ch)
+        assert chdr["sampling_frequency"] == hdr["sampling_frequency"]
+        assert cdat.dtype == dat.dtype
+        assert np.array_equal(cdat, dat)
+
+    # Modifying the file invalidates the entry
+    write_csv(fname, n=300)
+    st = os.stat(fname)
+    os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    bio = bb.load(fname, cache=True)
+    assert len(bio.get("ECG")[1]) == 300
+    assert len(biobabel.cache.entries()) == 2
+
+
+@pytest.mark.parametrize(
+    "fname", ["tests/samples/five_ecgs.xdf", "tests/samples/biopac_sample.acq"]
+)
+def test_cache_same_as_fresh(fname, tmp_path, monkeypatch):
+    # A cache hit gives the same date (even if empty) and channel order as loading the file
+    monkeypatch.setenv("BIOBABEL_CACHE_DIR", os.path.join(tmp_path, "cache"))
+    fresh = bb.load(fname, cache=True)
+    cached = bb.load(fname, cache=True)
+    assert biobabel.cache.entries()
+    assert cached.date == fresh.date
+    assert cached.find_channels() == fresh.find_channels()
+    for ch in fresh.find_channels():
+        assert cached.get(ch)[0]["participant"] == fresh.get(ch)[0]["participant"]
+
+
+def test_cache_eviction(tmp_path, monkeypatch):
+    monkeypatch.setenv("BIOBABEL_CACHE_DIR", os.path.join(tmp_path, "cache"))
+    paths = []
+    for i in range(3):
+        fname = os.path.join(tmp_path, "data{}.csv".format(i))
+        write_csv(fname)
+        bb.load(fname, cache=True)
+        paths.append(fname)
+        time.sleep(0.01)
+
+    ents = biobabel.cache.entries()
+    assert len(ents) == 3
+    oldest = ents[0][0]
+    assert biobabel.cache.get_source(oldest) == os.path.abspath(paths[0])
+
+    biobabel.cache.evict(sum(sz for (_, sz, _) in ents[1:]))
+    remaining = [p for (p, _, _) in biobabel.cache.entries()]
+    assert oldest not in remaining and len(remaining) == 2
+
+    biobabel.cache.clear()
+    assert biobabel.cache.entries() == []
@@ -0,0 +1,72 @@
+# Test that the channel lookup tables inside Biodata stay consistent
+# when channels are added, renamed, updated and dropped.
+
+import biobabel as bb
+import numpy as np
+
+
+def make_bio():
+    bio = bb.Biodata()
+    for p in ["a", "b"]:
+        for mod in ["ecg", "ppg"]:
+            hdr = {
+                "id": "{}_{}".format(p, mod),
+                "participant": p,
+                "sampling_frequency": 100,
+                "modality": mod,
+            }
+            bio.add_channel((hdr, np.zeros(10)))
+    return bio
+
+
+def test_find_indexed():
+    bio = make_bio()
+    assert bio.find_channels({"modality": "ecg"}) == ["a_ecg", "b_ecg"]
+    assert bio.find_channels({"participant": "b", "modality": "ppg"}) == ["b_ppg"]
+    assert bio.find_channels({"id": "a_ppg"}) == ["a_ppg"]
+    assert bio.get_participants() == ["a", "b"]
+
+
+def test_uniquefy():
+    bio = make_bio()
+    for _ in range(2):
+        hdr = {"id": "a_ecg", "participant": "a", "sampling_frequency": 100}
+        bio.add_channel((hdr, np.zeros(10)))
+    assert "a_ecg.1" in bio.find_channels()
+    assert "a_ecg.2" in bio.find_channels()
+
+
+def test_mutations_keep_index():
+    bio = make_bio()
+    bio.rename("a_ecg", "heart")
+    assert bio.get("heart")[0]["participant"] == "a"
+    assert bio.find_channels({"modality": "ecg"}) == ["heart", "b_ecg"]
+
+    bio.update_channel("b_ecg", {"modality": "eeg"})
+    assert bio.find_channels({"modality": "ecg"}) == ["heart"]
+    assert bio.find_channels({"modality": "eeg"}) == ["b_ecg"]
+
+    bio.drop("heart")
+    assert bio.find_channels({"participant": "a"}) == ["a_ppg"]
+    assert bio.get("heart") == (None, None)
+
+    bio.select({"participant": "b"})
+    assert bio.find_channels() == ["b_ecg", "b_ppg"]
+    assert bio.get_participants() == ["b"]
+
+
+def test_direct_changes_to_channels():
+    # Changes made to bio.channels behind our back are noticed
+    bio = make_bio()
+    bio.channels.reverse()
+    assert bio.get("a_ecg")[0]["id"] == "a_ecg"
+    assert bio.find_channels({"modality": "ecg"}) == ["b_ecg", "a_ecg"]
+
+    bio.channels[0] = ({"id": "new", "participant": "b", "sampling_frequency": 1}, np.zeros(1))
+    assert bio.get("new")[0]["participant"] == "b"
+    assert bio.get("b_ppg") == (None, None)
+    assert bio.find_channels({"participant": "b"}) == ["new", "b_ecg"]
+
+    bio.channels[1][0]["id"] = "renamed"
+    assert bio.get("renamed")[0]["modality"] == "ecg"
+    assert bio.find_channels({"modality": "ecg"}) == ["renamed", "a_ecg"]
@@ -0,0 +1,91 @@
+# Test cropping (and copying) of Biodata objects.
+
+import biobabel as bb
+import numpy as np
+
+
+def make_bio(n=1000):
+    bio = bb.Biodata()
+    for chid, SR in [("ecg", 100), ("ppg", 33.3)]:
+        hdr = {"id": chid, "sampling_frequency": SR, "modality": chid}
+        bio.add_channel((hdr, np.arange(n, dtype="f")))
+    bio.add_marker("tap", [1.0, 2.5, 8.0])
+    return bio
+
+
+def test_crop_matches_time_mask():
+    for tfrom, tend in [(1, 5), (0.015, 2.999), (None, 3), (2, None), (-1, 100)]:
+        bio = make_bio()
+        ref = make_bio()
+        bio.crop(tfrom, tend)
+        for chid in ["ecg", "ppg"]:
+            t = ref.get_time(chid)
+            lo = -np.inf if tfrom is None else tfrom
+            hi = np.inf if tend is None else tend
+            expected = ref.get(chid)[1][(t > lo) & (t < hi)]
+            assert np.array_equal(bio.get(chid)[1], expected)
+
+
+def test_crop_view_or_copy():
+    bio = make_bio()
+    orig = bio.get("ecg")[1]
+    bio.crop(1, 5)
+    assert np.shares_memory(bio.get("ecg")[1], orig)
+    np.testing.assert_array_equal(bio.get_marker("tap"), [1.5])
+
+    bio = make_bio()
+    orig = bio.get("ecg")[1]
+    bio.crop(1, 5, copy=True)
+    assert not np.shares_memory(bio.get("ecg")[1], orig)
+
+
+def test_copy_on_write():
+    bio = make_bio()
+    sub = bio.copy(cow=True)
+    assert np.shares_memory(sub.get("ecg")[1], bio.get("ecg")[1])
+
+    # The copy cannot modify the shared data in place
+    try:
+        sub.get("ecg")[1][0] = 5
+        assert False, "shared data should be read-only in the copy"
+    except ValueError:
+        pass
+
+    sub.crop(1, 5)
+    assert np.shares_memory(sub.get("ecg")[1], bio.get("ecg")[1])
+    assert len(bio.get("ecg")[1]) == 1000
+
+    _, dat = sub.get_writable("ecg")
+    dat[:] = -1
+    assert np.all(sub.get("ecg")[1] == -1)
+    assert bio.get("ecg")[1][150] == 150  # the original is untouched
+    assert np.shares_memory(sub.get("ppg")[1], bio.get("ppg")[1])
+
+
+def test_copy_on_write_source():
+    bio = make_bio()
+    sub = bio.copy(cow=True)
+
+    # Writing to the original through get() does not silently change the copy
+    hdr, dat = bio.get("ecg")
+    try:
+        dat -= dat.mean()
+        assert False, "shared data should be read-only in the original too"
+    except ValueError:
+        pass
+    assert sub.get("ecg")[1][0] == 0 and sub.get("ecg")[1][999] == 999
+
+    # The original can still be written to through get_writable(), which leaves the copy alone
+    _, dat = bio.get_writable("ecg")
+    dat -= dat.mean()
+    assert dat.flags.writeable and not np.shares_memory(dat, sub.get("ecg")[1])
+    assert sub.get("ecg")[1][0] == 0
+    assert bio.get("ecg")[1][0] == -499.5
+
+    # Once it has its own copy, the channel is no longer copied again
+    assert bio.get_writable("ecg")[1] is dat
+
+    # Channels that were not shared are written in place as before
+    bio2 = make_bio()
+    dat = bio2.get("ecg")[1]
+    assert bio2.get_writable("ecg")[1] is dat
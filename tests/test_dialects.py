@@ -0,0 +1,58 @@
+# Test the registry of dialects (file formats), including registering a new one.
+
+import biobabel as bb
+import biobabel.io
+import numpy as np
+import os
+
+
+def test_guess():
+    assert biobabel.io.guess_dialect("tests/samples/example.hdf5") == "hdphysio5"
+    assert biobabel.io.guess_dialect("tests/samples/five_ecgs.xdf") == "lsl"
+    assert biobabel.io.guess_dialect("tests/samples/SampleECG.txt") == "opensignals"
+
+
+def load_dummy(fname, channels=None):
+    bio = bb.Biodata()
+    hdr = {"id": "x", "participant": "p", "sampling_frequency": 10, "modality": "ecg"}
+    bio.add_channel((hdr, np.arange(100)))
+    return bio
+
+
+def test_register(tmp_path):
+    fname = os.path.join(tmp_path, "data.dummy")
+    with open(fname, "w") as f:
+        f.write("dummy")
+    bb.register_dialect("dummy", load_dummy, [".dummy"], description="Dummy format")
+    try:
+        assert biobabel.io.guess_dialect(fname) == "dummy"
+        assert ("Dummy format", ".dummy") in biobabel.io.get_compatible_file_types()
+
+        # Options not supported by the loader (here: tfrom, tend) are applied afterwards
+        bio = bb.load(fname, tfrom=2, tend=5)
+        _, dat = bio.get("x")
+        assert np.array_equal(dat, np.arange(21, 50))
+    finally:
+        del biobabel.io.DIALECTS["dummy"]
+
+
+def test_magic(tmp_path):
+    # Files are recognized by their contents, whatever their extension
+    for src, dialect in [
+        ("tests/samples/example.hdf5", "hdphysio5"),
+        ("tests/samples/five_ecgs.xdf", "lsl"),
+        ("tests/samples/biopac_sample.acq", "acq"),
+        ("tests/samples/SampleECG.txt", "opensignals"),
+    ]:
+        fname = os.path.join(tmp_path, "misnamed.csv")
+        with open(src, "rb") as f, open(fname, "wb") as g:
+            g.write(f.read())
+        assert biobabel.io.guess_dialect(fname) == dialect
+
+
+def test_single_line(tmp_path):
+    # Probing only reads the start of the file, even if it is one huge line
+    fname = os.path.join(tmp_path, "oneline.csv")
+    with open(fname, "w") as f:
+        f.write(",".join(["1"] * 1000000))
+    assert biobabel.io.guess_dialect(fname) == "csv"
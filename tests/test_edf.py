@@ -0,0 +1,62 @@
+# Test reading of EDF files, including reading only some channels and a time window.
+# We generate a small EDF file with pyedflib.
+
+import biobabel as bb
+from biobabel.biodata import sample_range
+import numpy as np
+import pyedflib
+import pytest
+import os
+
+
+@pytest.fixture
+def edf_file(tmp_path):
+    fname = os.path.join(tmp_path, "test.edf")
+    labels = ["ECG", "EEG Fp1", "Resp"]
+    headers = pyedflib.highlevel.make_signal_headers(
+        labels, sample_frequency=100, physical_min=-1000, physical_max=1000
+    )
+    headers[2]["sample_frequency"] = 25
+    signals = [np.arange(6000) / 10, np.zeros(6000), np.arange(1500) / 10]
+    pyedflib.highlevel.write_edf(fname, signals, headers)
+    yield fname
+
+
+def test_read_all(edf_file):
+    bio = bb.load(edf_file)
+    assert bio.find_channels() == ["ECG", "EEG Fp1", "Resp"]
+    _, dat = bio.get("Resp")
+    assert len(dat) == 1500
+
+
+def test_partial_read(edf_file):
+    full = bb.load(edf_file)
+    full.select(["ECG", "Resp"])
+    full.crop(10, 20.5)
+
+    part = bb.load(edf_file, channels=["ECG", "Resp"], tfrom=10, tend=20.5)
+    assert part.find_channels() == ["ECG", "Resp"]
+    for ch in part.find_channels():
+        assert np.allclose(part.get(ch)[1], full.get(ch)[1])
+    _, dat = part.get("ECG")
+    assert len(dat) == 1049  # samples strictly after 10 s and before 20.5 s
+    assert dat[0] == pytest.approx(100.1, abs=0.05)
+
+
+def test_sample_range():
+    SR, n = 3.0, 100
+    t = np.arange(n) / SR
+    for tfrom, tend in [(None, None), (1, 2), (0, 10), (-5, 50), (1 / 3, 2 / 3), (7.1, 7.2), (20, 10)]:
+        sel = np.ones(n, dtype=bool)
+        if tfrom is not None:
+            sel &= t > tfrom
+        if tend is not None:
+            sel &= t < tend
+        start, stop = sample_range(SR, n, tfrom, tend)
+        assert np.array_equal(np.flatnonzero(sel), np.arange(start, stop))
+
+
+def test_sample_range_past_end():
+    assert sample_range(100, 1000, 50) == (1000, 1000)
+    assert sample_range(100, 1000, 50, 60) == (1000, 1000)
+    assert sample_range(100, 1000, None, -5) == (0, 0)
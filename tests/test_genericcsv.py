@@ -0,0 +1,66 @@
+# Test reading of generic CSV files, where the delimiter, header
+# and time column need to be guessed.
+
+import biobabel as bb
+import biobabel.load_genericcsv
+import numpy as np
+from pytest import approx
+import os
+
+
+def write_csv(fname, sep=",", header=True, n=500):
+    with open(fname, "w") as f:
+        if header:
+            f.write(sep.join(["time", "ECG", "PPG", "comment"]) + "\n")
+        for i in range(n):
+            f.write(sep.join([str(4 * i), str(i % 7), str(0.5 * i), "ok"]) + "\n")
+
+
+def test_sniff(tmp_path):
+    fname = os.path.join(tmp_path, "data.csv")
+    write_csv(fname, sep=";")
+    opts = biobabel.load_genericcsv.sniff(fname)
+    assert opts["sep"] == ";"
+    assert opts["header"] == 0
+    assert opts["usecols"] == ["time", "ECG", "PPG"]  # non-numeric columns are left out
+
+
+def test_read(tmp_path):
+    fname = os.path.join(tmp_path, "data.csv")
+    write_csv(fname, sep="\t")
+    bio = bb.load(fname, dialect="csv")
+    hdr, dat = bio.get("ECG")
+    assert hdr["sampling_frequency"] == approx(250)
+    assert hdr["modality"] == "ecg"
+    assert len(dat) == 500
+
+
+def test_no_header_chunked(tmp_path):
+    fname = os.path.join(tmp_path, "data.csv")
+    write_csv(fname, header=False)
+    tab = biobabel.load_genericcsv.read_table(fname, chunksize=64)
+    assert list(tab.columns) == ["column1", "column2", "column3"]
+    assert tab.shape == (500, 3)
+    assert np.array_equal(tab["column1"], 4 * np.arange(500))
+
+
+def test_time_column(tmp_path):
+    fname = os.path.join(tmp_path, "data.csv")
+    write_csv(fname, n=50000)
+    tab = biobabel.load_genericcsv.read_table(fname)
+    tcol, divider = biobabel.load_genericcsv.guess_time_column(tab)
+    assert tcol == "time"
+
+    # A column that looks regular at the start but not further down is rejected,
+    # and the next column that qualifies is taken
+    tab.loc[40001:, "time"] = 0
+    tcol, divider = biobabel.load_genericcsv.guess_time_column(tab)
+    assert tcol == "PPG"
+
+
+def test_timing_metadata(tmp_path):
+    fname = os.path.join(tmp_path, "data.csv")
+    write_csv(fname)
+    bio = bb.load(fname, dialect="csv")
+    assert bio.meta["time_step_median"] == approx(0.004)
+    assert bio.meta["time_step_irregular"] == 0
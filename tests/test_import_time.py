@@ -0,0 +1,35 @@
+# Check that importing biobabel, and reading a native HDF5 file,
+# does not pull in the heavy dependencies needed only for other formats.
+# We run this in a fresh interpreter so that other tests don't interfere.
+
+import json
+import subprocess
+import sys
+
+SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import biobabel
+t1 = time.perf_counter()
+bio = biobabel.load("tests/samples/example.hdf5")
+t2 = time.perf_counter()
+heavy = ["pandas", "scipy", "pyxdf", "bioread", "pyedflib", "opensignalsreader", "matplotlib"]
+print(json.dumps({
+    "import_time": t1 - t0,
+    "load_time": t2 - t1,
+    "imported": [m for m in heavy if m in sys.modules],
+}))
+"""
+
+
+def test_import_time():
+    out = subprocess.run(
+        [sys.executable, "-c", SCRIPT], capture_output=True, text=True, check=True
+    )
+    res = json.loads(out.stdout.strip().split("\n")[-1])
+    print(
+        "import biobabel: {:.3f} s, load hdf5: {:.3f} s".format(
+            res["import_time"], res["load_time"]
+        )
+    )
+    assert res["imported"] == []
@@ -0,0 +1,45 @@
+# Test lazy loading of hdphysio5 files, where channel data is only
+# read from disk when it is accessed.
+
+import biobabel as bb
+import numpy as np
+import h5py
+import os
+
+H5_FILE = "tests/samples/example.hdf5"
+
+
+def test_lazy_matches_eager():
+    eager = bb.load(H5_FILE)
+    lazy = bb.load(H5_FILE, lazy=True)
+    assert eager.find_channels() == lazy.find_channels()
+    for ch in eager.find_channels():
+        _, a = eager.get(ch)
+        _, b = lazy.get(ch)
+        assert a.shape == b.shape
+        assert np.array_equal(a[100:200], b[100:200])
+        assert np.array_equal(a, np.array(b))
+
+
+def test_lazy_compressed(tmp_path):
+    # Chunked, compressed datasets cannot be memory-mapped, so they are read on demand
+    fname = os.path.join(tmp_path, "compressed.hdf5")
+    with h5py.File(fname, "w") as hf:
+        hf.attrs["participants"] = ["a"]
+        hf.create_group("a")
+        dset = hf["a"].create_dataset(
+            "ecg", data=np.arange(1000, dtype="f"), chunks=(100,), compression="gzip"
+        )
+        dset.attrs["SR"] = 100
+        dset.attrs["modality"] = "ecg"
+
+    bio = bb.load(fname, lazy=True)
+    _, dat = bio.get("ecg")
+    assert isinstance(dat, bb.load_hdphysio5.H5Channel)
+    assert len(dat) == 1000
+    assert np.array_equal(dat[10:20], np.arange(10, 20))
+    assert np.array_equal(dat[::100], np.arange(0, 1000, 100))
+
+    bio.crop(2, 3)
+    _, dat = bio.get("ecg")
+    assert np.array_equal(dat, np.arange(201, 300))
@@ -0,0 +1,52 @@
+# Test loading several files concurrently.
+
+import gc
+import os
+
+import biobabel as bb
+import numpy as np
+import pytest
+from biobabel.io import SHARED_MIN_BYTES, SharedArray
+
+FILES = [
+    "tests/samples/example.hdf5",
+    "tests/samples/five_ecgs.xdf",
+    "tests/samples/biopac_sample.acq",
+    "tests/samples/does_not_exist.hdf5",
+]
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_load_many(executor):
+    bios = bb.load_many(FILES, workers=2, executor=executor)
+    assert len(bios) == len(FILES)
+    assert bios[-1] is None  # file does not exist
+    for fname, bio in zip(FILES[:-1], bios):
+        ref = bb.load(fname)
+        assert bio.find_channels() == ref.find_channels()
+        for ch in ref.find_channels():
+            assert np.array_equal(bio.get(ch)[1], ref.get(ch)[1], equal_nan=True)
+
+
+def test_errors():
+    # Errors are returned in place of the Biodata object
+    bios = bb.load_many(FILES[:2], workers=2, dialect="edf")
+    assert all(isinstance(b, Exception) for b in bios)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="shared memory is only used on POSIX")
+def test_shared_memory_not_copied():
+    bio = bb.load_many(FILES[2:3] * 2, workers=2)[0]
+    ref = bb.load(FILES[2])
+    big = [
+        ch for ch in ref.find_channels() if ref.get(ch)[1].nbytes >= SHARED_MIN_BYTES
+    ]
+    assert big
+    dat = bio.get(big[0])[1]
+    assert isinstance(dat.base, SharedArray)  # uses the shared block directly
+
+    # The data stays valid after the Biodata object is gone
+    del bio
+    gc.collect()
+    assert np.array_equal(dat, ref.get(big[0])[1], equal_nan=True)
+    dat[0] = 1  # and the array can be written to
@@ -0,0 +1,58 @@
+# Test the level-of-detail pyramids used by the viewer.
+
+import biobabel as bb
+import biobabel.lod
+from biobabel.lod import Pyramid
+import numpy as np
+import os
+
+
+def test_window_bounded_and_faithful():
+    rng = np.random.default_rng(1)
+    vals = rng.standard_normal(1_000_003).astype("f")
+    vals[543210] = 50  # a spike
+    pyr = Pyramid.build(vals)
+    assert len(pyr.levels) > 2
+
+    for fromi, toi in [(0, len(vals)), (500000, 600000), (543000, 544000), (10, 20)]:
+        idx, env = pyr.window(vals, fromi, toi, 2000)
+        assert len(env) <= 2000 + 2
+        assert len(idx) == len(env)
+        assert np.all(np.diff(idx) >= 0)
+        # The bins may extend a little beyond the window, but never miss anything inside it
+        assert env.max() >= vals[fromi:toi].max()
+        assert env.min() <= vals[fromi:toi].min()
+        assert idx[0] <= fromi + 1
+
+    idx, env = pyr.window(vals, 0, len(vals), 2000)
+    assert env.max() == 50
+
+
+def test_persist(tmp_path):
+    fname = os.path.join(tmp_path, "rec.hdf5")
+    bio = bb.Biodata()
+    hdr = {"id": "ecg", "participant": "a", "sampling_frequency": 1000, "modality": "ecg"}
+    bio.add_channel((hdr, np.arange(100000, dtype="int16")))
+    bio.save(fname)
+    bio = bb.load(fname, lazy=True)
+
+    pyrs = biobabel.lod.get_pyramids(bio, ["ecg"], fname)
+    assert os.path.exists(biobabel.lod.sidecar_name(fname))
+    loaded = biobabel.lod.load(fname)
+    assert list(loaded.keys()) == ["ecg"]
+    for (mn, mx), (lmn, lmx) in zip(pyrs["ecg"].levels, loaded["ecg"].levels):
+        assert np.array_equal(mn, lmn) and np.array_equal(mx, lmx)
+
+    # Once the recording changes, the saved pyramids are no longer used
+    st = os.stat(fname)
+    os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert biobabel.lod.load(fname) is None
+
+
+def test_nan_gap():
+    vals = np.arange(100000.0)
+    vals[40000:40010] = np.nan
+    pyr = Pyramid.build(vals)
+    idx, env = pyr.window(vals, 0, len(vals), 200)
+    assert not np.any(np.isnan(env))
+    assert env.max() == 99999
@@ -0,0 +1,62 @@
+# Test marker storage: sorting, range queries, labels and durations.
+
+import biobabel as bb
+import numpy as np
+import os
+
+
+def make_bio():
+    bio = bb.Biodata()
+    hdr = {"id": "ecg", "participant": "a", "sampling_frequency": 100, "modality": "ecg"}
+    bio.add_channel((hdr, np.zeros(1000)))
+    bio.add_marker(
+        "tap",
+        [5.0, 1.0, 3.0, 8.0],
+        labels=["e", "a", "c", "h"],
+        durations=[0.5, 0.1, 0.3, 0.8],
+    )
+    bio.add_marker("beat", 2.5)
+    return bio
+
+
+def test_sorted_and_ranges():
+    bio = make_bio()
+    assert list(bio.get_marker("tap")) == [1.0, 3.0, 5.0, 8.0]
+    assert list(bio.get_marker_labels("tap")) == ["a", "c", "e", "h"]
+    assert list(bio.get_marker("tap", 3, 5)) == [3.0, 5.0]  # inclusive
+    assert bio.marker_range("tap", 3, 5) == (2, 2)  # exclusive, as used by crop()
+    assert len(bio.get_marker("nothing")) == 0
+    assert bio.get_marker_labels("beat") is None
+
+    # Markers assigned directly (as older code did) are sorted when used
+    bio.markers["old"] = [4.0, 2.0]
+    assert list(bio.get_marker("old", 0, 3)) == [2.0]
+
+
+def test_crop_and_copy():
+    bio = make_bio()
+    cp = bio.copy()
+    bio.crop(2, 6)
+    assert list(bio.get_marker("tap")) == [1.0, 3.0]
+    assert list(bio.get_marker_labels("tap")) == ["c", "e"]
+    assert list(bio.get_marker_durations("tap")) == [0.3, 0.5]
+    assert list(bio.get_marker("beat")) == [0.5]
+    assert len(cp.get_marker("tap")) == 4  # the copy is unaffected
+
+
+def test_extend_marker():
+    bio = make_bio()
+    bio.extend_marker("tap", [2.0], labels=["b"])
+    assert list(bio.get_marker("tap")) == [1.0, 2.0, 3.0, 5.0, 8.0]
+    assert list(bio.get_marker_labels("tap")) == ["a", "b", "c", "e", "h"]
+    assert list(bio.get_marker_durations("tap")) == [0.1, 0.0, 0.3, 0.5, 0.8]
+
+
+def test_save_load(tmp_path):
+    fname = os.path.join(tmp_path, "markers.hdf5")
+    make_bio().save(fname)
+    bio = bb.load(fname)
+    assert list(bio.get_marker("tap")) == [1.0, 3.0, 5.0, 8.0]
+    assert list(bio.get_marker_labels("tap")) == ["a", "c", "e", "h"]
+    assert list(bio.get_marker_durations("tap")) == [0.1, 0.3, 0.5, 0.8]
+    assert bio.get_marker_labels("beat") is None
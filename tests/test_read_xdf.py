@@ -1,6 +1,8 @@
 
 import pytest
 import biobabel as bb
+import biobabel.load_lsl
+import numpy as np
 
 
 def test_read_opensignals():
@@ -10,3 +12,37 @@ def test_read_opensignals():
     assert 'C2AA3623' in channels
 
     
+
+
+def test_resample_multichannel():
+    timestamps = np.array([0.0, 0.9, 2.1, 3.0])
+    values = np.array([[0, 10], [1, 11], [2, 12], [3, 13]], dtype="float32")
+    target_t = np.array([-1, 0, 0.5, 1, 1.5, 2, 3, 4])
+    out = biobabel.load_lsl.resample_nearest(timestamps, values, target_t)
+    assert out.shape == (8, 2)
+    assert out.dtype == np.float32
+    assert np.array_equal(out[:, 0], [np.nan, 0, 1, 1, 1, 2, 3, np.nan], equal_nan=True)
+    assert np.array_equal(out[:, 1], out[:, 0] + 10, equal_nan=True)
+
+
+def test_channel_info():
+    info = {
+        "desc": [
+            {"channels": [{"channel": [
+                {"label": ["Fp1"], "unit": ["microvolts"], "type": ["EEG"]},
+                {"label": ["ECG"], "unit": ["mV"]},
+            ]}]}
+        ]
+    }
+    chans = biobabel.load_lsl.get_channel_info(info, 3)
+    assert chans[0] == {"label": "Fp1", "unit": "microvolts", "type": "EEG"}
+    assert chans[1] == {"label": "ECG", "unit": "mV"}
+    assert chans[2] == {}
+
+
+def test_select_streams():
+    bio = bb.load('tests/samples/five_ecgs.xdf', streams=['C2AA3623', {'name': 'C2A7A928'}])
+    assert sorted(bio.find_channels()) == ['C2A7A928', 'C2AA3623']
+
+    bio = bb.load('tests/samples/five_ecgs.xdf', channels='C2A99E2C')
+    assert bio.find_channels() == ['C2A99E2C']
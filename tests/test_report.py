@@ -0,0 +1,74 @@
+# Test plotting helpers and the HTML report.
+
+import biobabel as bb
+from biobabel.biodata import envelope
+import numpy as np
+import os
+
+
+def test_envelope_nan():
+    vals = np.arange(10000.0)
+    vals[5000] = np.nan  # a gap, as in resampled XDF streams
+    idx, env = envelope(vals, 100)
+    assert np.sum(np.isnan(env)) == 0  # the rest of the bucket is still shown
+    assert env.max() == 9999
+
+
+def test_envelope_keeps_extremes():
+    vals = np.zeros(100000)
+    vals[12345] = 5  # a single spike, which every-n-th sample subsampling would miss
+    vals[77777] = -3
+    idx, env = envelope(vals, 2000)
+    assert len(env) <= 2000
+    assert len(idx) == len(env)
+    assert env.max() == 5 and env.min() == -3
+    assert np.all(np.diff(idx) >= 0)
+
+    # Short signals are left alone
+    idx, env = envelope(np.arange(10.0), 2000)
+    assert np.array_equal(env, np.arange(10.0))
+
+
+def test_report_images(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bio = bb.Biodata()
+    hdr = {"id": "ecg", "participant": "a", "sampling_frequency": 100, "modality": "ecg"}
+    bio.add_channel((hdr, np.random.randn(10000)))
+    bio.save("rec.hdf5")
+
+    bb.use_agg()
+    h, images = bb.report_fragment("rec.hdf5", imgdir="report_files")
+    assert len(images) == 4  # full recording plus beginning, middle and end
+    for f in images:
+        assert os.path.exists(f)
+        assert f.replace(os.sep, "/") in h
+    assert "base64" not in h
+
+    # Images left over from an earlier report are not included
+    stale = images[0].replace("_0.jpg", "_9.jpg")
+    open(stale, "w").close()
+    h, images = bb.report_fragment("rec.hdf5", imgdir="report_files")
+    assert len(images) == 4 and stale not in images
+
+    h, images = bb.report_fragment("rec.hdf5")
+    assert images == [] and "base64" in h
+
+
+def test_plot_timerange():
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    bio = bb.Biodata()
+    hdr = {"id": "ecg", "participant": "a", "sampling_frequency": 100, "modality": "ecg"}
+    vals = np.random.randn(1000)
+    bio.add_channel((hdr, vals))
+    t = np.arange(1000) / 100
+    for trange in [(1, 5), (0, 2.005), None]:
+        f = bio.plot(timerange=trange, show=False, max_points=None)
+        x, y = f.axes[0].lines[0].get_data()
+        tsel = np.ones(1000, dtype=bool) if trange is None else (t >= trange[0]) & (t <= trange[1])
+        assert np.allclose(x, t[tsel])
+        assert np.array_equal(y, vals[tsel])
+        plt.close(f)
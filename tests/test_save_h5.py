@@ -0,0 +1,168 @@
+# Test writing hdphysio5 files: data types, compression and appending.
+
+import biobabel as bb
+from biobabel.save_hdphysio5 import Writer
+import numpy as np
+import h5py
+import os
+
+
+def make_bio():
+    bio = bb.Biodata()
+    bio.name = "test"
+    hdr = {
+        "id": "adc",
+        "participant": "a",
+        "sampling_frequency": 100,
+        "modality": "ecg",
+        "units": "a.u.",
+    }
+    bio.add_channel((hdr, np.arange(-500, 500, dtype="int16")))
+    hdr = {"id": "ppg", "participant": "a", "sampling_frequency": 50, "modality": "ppg"}
+    bio.add_channel((hdr, np.linspace(0, 1, 500)))
+    bio.add_marker("go", [1.0, 2.5])
+    return bio
+
+
+def test_dtype_preserved(tmp_path):
+    fname = os.path.join(tmp_path, "out.hdf5")
+    make_bio().save(fname)
+    bio = bb.load(fname)
+    _, dat = bio.get("adc")
+    assert dat.dtype == np.int16
+    assert np.array_equal(dat, np.arange(-500, 500))
+    _, dat = bio.get("ppg")
+    assert dat.dtype == np.float32  # floats are stored in single precision as before
+    assert list(bio.get_marker("go")) == [1.0, 2.5]
+
+
+def test_integer_dtype_kept(tmp_path):
+    # Integer data is stored in the type it has in memory, whatever its values
+    fname = os.path.join(tmp_path, "out.hdf5")
+    bio = make_bio()
+    hdr = {"id": "small", "participant": "a", "sampling_frequency": 100, "modality": "ecg"}
+    bio.add_channel((hdr, np.array([0, 5, 100], dtype=np.int16)))
+    hdr = {"id": "wide", "participant": "a", "sampling_frequency": 100, "modality": "ecg"}
+    bio.add_channel((hdr, np.arange(-100, 900, dtype=np.int64)))
+    bio.save(fname)
+    out = bb.load(fname)
+    _, dat = out.get("small")
+    assert dat.dtype == np.int16
+    assert list(dat * 2) == [0, 10, 200]
+    assert out.get("wide")[1].dtype == np.int64
+
+    outf = os.path.join(tmp_path, "merged.hdf5")
+    bb.save_hdphysio5.merge_files([fname, fname], outf, concat=True)
+    merged = bb.load(outf)
+    assert merged.get("small")[1].dtype == np.int16
+    assert merged.get("wide")[1].dtype == np.int64
+
+
+def test_compressed(tmp_path):
+    fname = os.path.join(tmp_path, "out.hdf5")
+    make_bio().save(fname, compression="gzip", shuffle=True, chunks=128)
+    with h5py.File(fname, "r") as hf:
+        dset = hf["a"]["adc"]
+        assert dset.compression == "gzip"
+        assert dset.shuffle
+        assert dset.chunks == (128,)
+    _, dat = bb.load(fname).get("adc")
+    assert np.array_equal(dat, np.arange(-500, 500))
+
+
+def test_append(tmp_path):
+    fname = os.path.join(tmp_path, "out.hdf5")
+    hdr = {"id": "ecg", "participant": "p", "sampling_frequency": 10, "modality": "ecg"}
+    with Writer(fname, compression="lzf") as w:
+        w.create_channel(hdr, dtype="int16")
+        for i in range(5):
+            w.append("ecg", np.arange(i * 10, (i + 1) * 10))
+    bio = bb.load(fname)
+    _, dat = bio.get("ecg")
+    assert dat.dtype == np.int16
+    assert np.array_equal(dat, np.arange(50))
+    assert bio.get_duration("ecg") == 5
+
+
+def test_write_segments(tmp_path, monkeypatch):
+    import biobabel.save_hdphysio5
+
+    monkeypatch.setattr(biobabel.save_hdphysio5, "WRITE_BLOCK_SIZE", 64)
+    fname = os.path.join(tmp_path, "full.hdf5")
+    make_bio().save(fname)
+    bio = bb.load(fname, lazy=True)
+
+    cuts = [(0, 1.0), (1.0, 2.5), (2.5, 10)]
+    segments = [
+        (os.path.join(tmp_path, "seg{}.hdf5".format(i)), a, b)
+        for i, (a, b) in enumerate(cuts)
+    ]
+    biobabel.save_hdphysio5.write_segments(bio, segments)
+
+    for (segf, a, b) in segments:
+        ref = bb.load(fname)
+        ref.crop(a, b)
+        seg = bb.load(segf)
+        for chid in ["adc", "ppg"]:
+            _, dat = seg.get(chid)
+            assert dat.dtype == ref.get(chid)[1].dtype
+            assert np.array_equal(dat, ref.get(chid)[1])
+        for m in ref.get_markers():
+            assert list(seg.get_marker(m)) == list(ref.get_marker(m))
+        assert seg.meta["filename"] == segf
+
+
+def test_merge_files(tmp_path):
+    from biobabel.save_hdphysio5 import merge_files
+
+    fnames = []
+    for i in range(3):
+        fname = os.path.join(tmp_path, "part{}.hdf5".format(i))
+        bio = make_bio()
+        bio.markers = {"go": [1.0 + i]}
+        bio.save(fname)
+        fnames.append(fname)
+
+    # Side by side, as Biodata.merge() does
+    outf = os.path.join(tmp_path, "merged.hdf5")
+    merge_files([fnames[0], fnames[1], fnames[0]], outf)
+    merged = bb.load(outf)
+    assert merged.find_channels() == ["adc", "ppg", "adc.1", "ppg.1", "adc.2", "ppg.2"]
+    ref = make_bio()
+    for chid in ["adc", "ppg"]:
+        _, expected = ref.get(chid)
+        for suffix in ["", ".1", ".2"]:
+            hdr, dat = merged.get(chid + suffix)
+            assert dat.dtype == np.dtype("int16" if chid == "adc" else "f")
+            assert np.allclose(dat, expected)
+    # Markers with the same name are combined, without repeating events
+    assert list(merged.get_marker("go")) == [1.0, 2.0]
+
+    # Concatenated in time
+    outf = os.path.join(tmp_path, "concat.hdf5")
+    merge_files(fnames, outf, concat=True, workers=2)
+    merged = bb.load(outf)
+    _, dat = merged.get("adc")
+    assert dat.dtype == np.int16
+    assert np.array_equal(dat, np.tile(np.arange(-500, 500), 3))
+    assert len(merged.get("ppg")[1]) == 1500
+    assert list(merged.get_marker("go")) == [1.0, 12.0, 23.0]  # shifted by 10s per file
+
+
+def test_merge_files_failure(tmp_path):
+    from biobabel.save_hdphysio5 import merge_files
+    import pytest
+
+    fnames = []
+    for SR in [100, 200]:
+        fname = os.path.join(tmp_path, "sr{}.hdf5".format(SR))
+        bio = make_bio()
+        bio.update_channel("adc", {"sampling_frequency": SR})
+        bio.save(fname)
+        fnames.append(fname)
+
+    outf = os.path.join(tmp_path, "concat.hdf5")
+    with pytest.raises(ValueError):
+        merge_files(fnames, outf, concat=True)
+    assert not os.path.exists(outf)
+    assert not os.path.exists(outf + ".tmp")
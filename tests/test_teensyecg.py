@@ -0,0 +1,109 @@
+# Test reading of TeensyECG log files.
+# We generate a small synthetic log file in the same format as the Teensy boxes write.
+
+import biobabel as bb
+import numpy as np
+from pytest import approx
+import pytest
+import os
+
+
+def write_teensy_log(fname, nsamp=1000, start=0):
+    with open(fname, "w") as f:
+        f.write('# CONFIG {"device": "teensy-3"}\n')
+        f.write("0 0 raw 1 2 3 4 5 6\n")  # junk before the start signal
+        f.write("12 # Start signal received\n")
+        for i in range(start, start + nsamp):
+            f.write("{} 0 raw {} {} {} {} {} {}\n".format(i, 5000 + 2 * i, i, -i, 7, 2 * i, 0))
+            if i % 250 == 100:
+                f.write("{} # 1 beep {}\n".format(i, 5000 + 2 * i))
+
+
+@pytest.fixture
+def teensy_file(tmp_path):
+    fname = os.path.join(tmp_path, "teensy.txt")
+    write_teensy_log(fname)
+    yield fname
+
+
+def test_read(teensy_file):
+    bio = bb.load(teensy_file, dialect="teensyecg")
+    assert bio.find_channels() == ["fsr", "ecg", "therm", "ppg", "snd"]
+    hdr, dat = bio.get("ecg")
+    assert hdr["sampling_frequency"] == approx(500)
+    assert np.array_equal(dat, -np.arange(1000))
+    assert dat.flags.c_contiguous
+    assert dat.dtype == np.int16  # compact integers rather than int64
+    assert bio.meta["device"] == "teensy-3"
+    assert list(bio.get_marker("beep")) == approx([0.2, 0.7, 1.2, 1.7])
+
+
+def test_malformed_lines(tmp_path):
+    fname = os.path.join(tmp_path, "teensy.txt")
+    write_teensy_log(fname, 100)
+    with open(fname, "a") as f:
+        f.write("100 0 raw 5200 1 2\n")  # truncated line
+        f.write("101 0 raw 5202 1 x 3 4 5\n")  # garbled line
+    write_teensy_log(fname + ".2", 100, start=102)
+    with open(fname, "a") as f, open(fname + ".2") as g:
+        f.write("".join(g.readlines()[3:]))
+    bio = bb.load(fname, dialect="teensyecg")
+    _, dat = bio.get("fsr")
+    assert len(dat) == 200
+
+
+def test_stream(tmp_path):
+    # Simulate a file that is still being written, with the last line incomplete
+    fname = os.path.join(tmp_path, "teensy.txt")
+    write_teensy_log(fname, 300)
+    with open(fname, "a") as f:
+        f.write("300 0 raw 5600 300 -3")
+
+    stream = bb.load_teensyecg.TeensyECGStream(fname)
+    bio = stream.bio
+    _, dat = bio.get("ecg")
+    assert len(dat) == 300
+    assert bio.meta["device"] == "teensy-3"
+
+    assert stream.poll() == 0  # nothing new
+
+    # Finish the line and add some more
+    write_teensy_log(fname + ".2", 700, start=300)
+    with open(fname + ".2") as g:
+        rest = g.readlines()[3:]
+    with open(fname, "a") as f:
+        f.write("00 7 600 0\n")
+        f.write("".join(rest[1:]))
+    assert stream.poll() == 700
+    _, dat = bio.get("ecg")
+    assert np.array_equal(dat, -np.arange(1000))
+    assert dat.flags.c_contiguous
+    assert bio.get("ecg")[0]["sampling_frequency"] == approx(500)
+    assert list(bio.get_marker("beep")) == approx([0.2, 0.7, 1.2, 1.7])
+
+    # Same result as reading the file in one go
+    full = bb.load(fname, dialect="teensyecg")
+    for ch in full.find_channels():
+        assert np.array_equal(full.get(ch)[1], bio.get(ch)[1])
+
+
+def test_stream_sampling_rate(tmp_path):
+    # The sampling rate changes halfway through: the stream should end up with the
+    # same estimate (the median time step over the whole file) as load()
+    fname = os.path.join(tmp_path, "teensy.txt")
+    write_teensy_log(fname, 300)
+    stream = bb.load_teensyecg.TeensyECGStream(fname)
+    assert stream.SR == approx(500)
+    beeps = stream.bio.get_marker("beep")
+
+    with open(fname, "a") as f:
+        for i in range(300, 1000):
+            f.write("{} 0 raw {} 0 0 0 0 0\n".format(i, 5000 + 600 + (i - 300)))
+        f.write("1000 # 1 beep 6300\n")
+    assert stream.poll() == 700
+    full = bb.load(fname, dialect="teensyecg")
+    assert stream.SR == full.get("ecg")[0]["sampling_frequency"] == approx(1000)
+
+    # Only the new event was added to the markers
+    assert list(stream.bio.get_marker("beep")) == approx(list(beeps) + [1.3])
+    assert list(full.get_marker("beep")) == list(stream.bio.get_marker("beep"))
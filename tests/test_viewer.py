@@ -0,0 +1,89 @@
+# Test the background computation of viewer windows (without opening a window).
+
+import biobabel as bb
+import numpy as np
+import threading
+from concurrent.futures import Future
+
+
+class FakeRoot:
+    # Records what would be scheduled on the Tk thread
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, func):
+        self.scheduled.append(func)
+
+
+def test_get_window_does_not_block(monkeypatch):
+    import biobabel.viewer as viewer
+
+    bio = bb.Biodata()
+    hdr = {"id": "ecg", "participant": "a", "sampling_frequency": 100, "modality": "ecg"}
+    bio.add_channel((hdr, np.arange(100000.0)))
+    viewer.gb.clear()
+    viewer.gb.update({"bio": bio, "lod": {}, "root": FakeRoot()})
+    viewer.load_channels(["ecg"])
+
+    # Make reading the data slow, as for a file on a remote disk
+    release = threading.Event()
+    started = threading.Event()
+    compute = viewer.compute_window
+
+    def slow_compute(key):
+        started.set()
+        release.wait(10)
+        return compute(key)
+
+    monkeypatch.setattr(viewer, "compute_window", slow_compute)
+    try:
+        # A prefetch of the window is running...
+        key = viewer.window_key("ecg", 10, 25)
+        fut = viewer.get_prefetcher().submit(viewer.compute_window, key)
+        viewer.remember_window(key, fut)
+        assert started.wait(10)
+
+        # ... and asking for that window returns right away rather than waiting for it
+        assert viewer.get_window("ecg", 10, 25) is None
+        assert not fut.done()
+
+        release.set()
+        fut.result(10)
+        assert viewer.gb["root"].scheduled == []  # nothing is scheduled from the worker thread
+
+        # The Tk thread picks up the finished window, and redraws
+        redraws = []
+        monkeypatch.setattr(viewer, "redraw", lambda: redraws.append(True))
+        viewer.poll_ready_windows()
+        assert redraws == [True]
+        assert viewer.gb["root"].scheduled == [viewer.poll_ready_windows]
+        viewer.poll_ready_windows()
+        assert redraws == [True]  # only once
+
+        x, y = viewer.get_window("ecg", 10, 25)
+        assert x[0] == 10 and y[0] == 1000
+    finally:
+        release.set()
+        viewer.gb["prefetcher"].shutdown()
+        viewer.gb.clear()
+
+
+def test_get_window_error(monkeypatch):
+    import biobabel.viewer as viewer
+
+    bio = bb.Biodata()
+    hdr = {"id": "ecg", "participant": "a", "sampling_frequency": 100, "modality": "ecg"}
+    bio.add_channel((hdr, np.arange(100000.0)))
+    viewer.gb.clear()
+    viewer.gb.update({"bio": bio, "lod": {}, "root": FakeRoot()})
+    viewer.load_channels(["ecg"])
+    try:
+        # A window whose background computation failed is computed again on the spot
+        key = viewer.window_key("ecg", 10, 25)
+        fut = Future()
+        fut.set_exception(OSError("network drive went away"))
+        viewer.remember_window(key, fut)
+        x, y = viewer.get_window("ecg", 10, 25)
+        assert x[0] == 10 and y[0] == 1000
+    finally:
+        viewer.gb.clear()
@@ -1,5 +1,4 @@
-# Test to see if an error is thrown when reading a file
-# that has the wrong extension. 
+# Test reading of a file that has the wrong extension. 
 
 import biobabel as bb
 from pytest import approx
@@ -10,9 +9,17 @@ ACQ_EDF_FILE = "tests/samples/biopac_sample_wrong_extension.edf"
 def test_wrong_extension():
     # Here we read a file that is in the AcqKnowledge format,
     # but has been given the (erroneous) edf extension.
-    # The desired behavior is to raise an exception.
+    # The format is recognized from the file contents, so the file is read correctly.
+    bio = bb.load(ACQ_EDF_FILE)
+    _, dat = bio.get('PPG, X, PPGED-R')
+    assert dat[1]==approx(0.36407470703125) # point check that data is read correctly
+
+
+def test_wrong_dialect():
+    # If we insist on reading the file as EDF,
+    # the desired behavior is to raise an exception.
     with pytest.raises(OSError):
-        bio = bb.load(ACQ_EDF_FILE)
+        bio = bb.load(ACQ_EDF_FILE, dialect="edf")
 
 
 